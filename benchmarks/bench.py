@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Reproducible benchmarks for bytehold handlers.
+
+Generates synthetic data sets (many small files, a few huge files,
+compressible and incompressible content and fake dump streams), runs
+each handler end to end with ``bh`` and reports wall time, throughput,
+peak rss, peak spool disk usage and stored bytes as json. Peak rss is
+``ru_maxrss`` from ``wait4``: the largest resident set of a single process
+(bh or one of its children), not the sum of concurrent processes.
+
+By default databases and backup host are replaced by local stand-ins:
+``pg_dump`` and ``mysqldump`` shims that write a deterministic sql stream,
+and ``scp``/``ssh`` shims that copy to a local directory. With ``--ssh-host``
+real scp and ssh are used against that host (for example a localhost sshd).
+
+Usage::
+
+    python3 benchmarks/bench.py -o before.json
+    python3 benchmarks/bench.py -o after.json
+    python3 benchmarks/bench.py --compare before.json after.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SQL_DUMP_SHIM = r'''#!{python}
+import sys, random
+random.seed({seed})
+size, written, row = {size}, 0, 0
+out = sys.stdout.buffer
+out.write(b"CREATE TABLE bench (id integer, name text, value numeric);\nCOPY bench FROM stdin;\n")
+words = [b"alpha", b"beta", b"gamma", b"delta", b"epsilon", b"zeta", b"eta", b"theta"]
+while written < size:
+    lines = []
+    for i in range(1000):
+        row += 1
+        lines.append(b"%d\t%s %s\t%d.%02d\n" % (row, random.choice(words), random.choice(words),
+                                               random.randint(0, 100000), random.randint(0, 99)))
+    chunk = b"".join(lines)
+    out.write(chunk)
+    written += len(chunk)
+out.write(b"\\.\n")
+'''
+
+SCP_SHIM = r'''#!/bin/sh
+# fake scp: copies to a local path, ignoring host and options
+for last; do :; done
+eval src=\${{$(($#-1))}}
+exec cp "$src" "{remote}${{last#*:}}"
+'''
+
+SSH_SHIM = r'''#!/bin/sh
+# fake ssh: executes command locally, ignoring host
+shift
+cd {remote} && exec sh -c "$*"
+'''
+
+
+def dir_usage(path):
+    """
+    Returns bytes used on disk by all files under path.
+    """
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, fname)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def write_executable(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+class Workspace(object):
+    """
+    Directory with synthetic data sets, command shims, spool
+    directory and fake backup host.
+    """
+
+    def __init__(self, path, scale, seed):
+        self.path = path
+        self.scale = scale
+        self.seed = seed
+        self.data = os.path.join(path, "data")
+        self.bin = os.path.join(path, "bin")
+        self.spool = os.path.join(path, "spool")
+        self.remote = os.path.join(path, "remote")
+        self.dump_size = int(64 * 1024 * 1024 * scale)
+
+    def mb(self, size):
+        return int(size * 1024 * 1024 * self.scale)
+
+    def generate(self):
+        rnd = random.Random(self.seed)
+        for path in (self.data, self.bin, self.spool, self.remote):
+            os.makedirs(path, exist_ok=True)
+
+        # many small files with text content
+        small = os.path.join(self.data, "small")
+        os.makedirs(small, exist_ok=True)
+        words = ["backup", "hold", "byte", "stream", "volume", "archive", "restore", "host"]
+        for i in range(max(1, int(2000 * self.scale))):
+            subdir = os.path.join(small, "d{0:03d}".format(i % 50))
+            os.makedirs(subdir, exist_ok=True)
+            with open(os.path.join(subdir, "f{0:05d}.txt".format(i)), "w") as f:
+                f.write(" ".join(rnd.choice(words) for x in range(rnd.randint(100, 1000))))
+
+        # a few huge files, compressible and incompressible
+        huge = os.path.join(self.data, "huge")
+        os.makedirs(huge, exist_ok=True)
+        block = " ".join(rnd.choice(words) for x in range(200000)).encode("utf-8")
+        for i in range(2):
+            self.write_file(os.path.join(huge, "text{0}.log".format(i)), self.mb(32),
+                            lambda: block)
+
+        random_block = bytes(rnd.getrandbits(8) for x in range(1024 * 1024))
+        self.write_file(os.path.join(huge, "random.bin"), self.mb(32),
+                        lambda: random_block[rnd.randint(0, 1024):] + random_block[:rnd.randint(0, 1024)])
+
+        # command shims
+        for name in ("pg_dump", "mysqldump"):
+            write_executable(os.path.join(self.bin, name), SQL_DUMP_SHIM.format(
+                python=sys.executable, seed=self.seed, size=self.dump_size))
+        write_executable(os.path.join(self.bin, "scp"), SCP_SHIM.format(remote=""))
+        write_executable(os.path.join(self.bin, "ssh"), SSH_SHIM.format(remote="/"))
+
+    def write_file(self, path, size, block):
+        written = 0
+        with open(path, "wb") as f:
+            while written < size:
+                chunk = block()[:size - written]
+                f.write(chunk)
+                written += len(chunk)
+
+    def input_bytes(self, *paths):
+        total = 0
+        for path in paths:
+            for dirpath, dirnames, filenames in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+        return total
+
+    def reset(self):
+        for path in (self.spool, self.remote):
+            shutil.rmtree(path)
+            os.makedirs(path)
+        # backup host directory of the environment should exist
+        os.makedirs(os.path.join(self.remote, "bench"))
+
+
+class Benchmark(object):
+    def __init__(self, workspace, ssh_host=None, remote_path=None):
+        self.ws = workspace
+        self.ssh_host = ssh_host
+        self.remote_path = remote_path
+
+    def environment(self, **extra):
+        config = {"name": "bench"}
+        if self.ssh_host:
+            config.update(remote_host=self.ssh_host, remote_path=self.remote_path)
+        else:
+            config.update(remote_host="bench", remote_path=self.ws.remote,
+                          scp_command=os.path.join(self.ws.bin, "scp"),
+                          ssh_command=os.path.join(self.ws.bin, "ssh"))
+        config.update(extra)
+        return config
+
+    def cases(self):
+        data = self.ws.data
+        small = os.path.join(data, "small")
+        huge = os.path.join(data, "huge")
+        pg_dump = os.path.join(self.ws.bin, "pg_dump")
+        mysqldump = os.path.join(self.ws.bin, "mysqldump")
+        dump = {"dbname": "bench", "user": "bench"}
+
+        yield "tarball-small-files", "Tarball", {}, \
+            dict(base_path=data, paths=["small"]), self.ws.input_bytes(small)
+        yield "tarball-huge-files", "Tarball", {}, \
+            dict(base_path=data, paths=["huge"]), self.ws.input_bytes(huge)
+        yield "tarball-huge-files-gzip", "Tarball", {}, \
+            dict(base_path=data, paths=["huge"], compress_format="gzip"), self.ws.input_bytes(huge)
+        yield "tarball-huge-files-volumes", "Tarball", {}, \
+            dict(base_path=data, paths=["huge"], volume_size="16M"), self.ws.input_bytes(huge)
+        yield "tarball-huge-files-local", "Tarball", {"destination": "local"}, \
+            dict(base_path=data, paths=["huge"], compress_format="gzip"), self.ws.input_bytes(huge)
+        yield "postgresql-dump", "PostgreSQL", {}, \
+            dict(pg_dump_command=pg_dump, **dump), self.ws.dump_size
+        yield "postgresql-dump-volumes", "PostgreSQL", {}, \
+            dict(pg_dump_command=pg_dump, volume_size="16M", **dump), self.ws.dump_size
+        yield "mysql-dump", "MySQL", {}, \
+            dict(mysqldump_command=mysqldump, type="sql", **dump), self.ws.dump_size
+
+        if shutil.which("rsync") or self.ssh_host:
+            yield "filesystem-rsync", "FileSystem", {}, \
+                dict(paths=[small, huge]), self.ws.input_bytes(small, huge)
+
+    def write_config(self, handler, env_config, handler_config):
+        path = os.path.join(self.ws.path, "config.py")
+        with open(path, "w") as f:
+            f.write("from bytehold import Environment\n")
+            f.write("from bytehold.handlers import {0}\n".format(handler))
+            f.write("Environment(**{0!r})\n".format(env_config))
+            f.write("{0}(name='bench', **{1!r})\n".format(handler, handler_config))
+        return path
+
+    def run_case(self, name, handler, env_extra, handler_config, input_bytes):
+        self.ws.reset()
+        env_config = self.environment(**env_extra)
+        if env_config.get("destination") == "local":
+            env_config["remote_path"] = self.ws.remote
+
+        config_path = self.write_config(handler, env_config, handler_config)
+        environ = dict(os.environ, TMPDIR=self.ws.spool, PYTHONPATH=ROOT,
+                       PATH=self.ws.bin + os.pathsep + os.environ.get("PATH", ""))
+
+        peak_spool = [0]
+        done = threading.Event()
+
+        def watch_spool():
+            while not done.wait(0.05):
+                peak_spool[0] = max(peak_spool[0], dir_usage(self.ws.spool))
+
+        watcher = threading.Thread(target=watch_spool)
+        watcher.start()
+
+        start = time.time()
+        p = subprocess.Popen([sys.executable, os.path.join(ROOT, "bh"), "-p", config_path],
+                             env=environ, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = p.stderr.read()
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.time() - start
+
+        done.set()
+        watcher.join()
+
+        result = {
+            "name": name,
+            "handler": handler,
+            "ok": p.returncode == 0,
+            "wall_seconds": round(wall, 3),
+            "input_bytes": input_bytes,
+            "throughput_mb_s": round(input_bytes / wall / 1024 / 1024, 2),
+            "peak_rss_kb": rusage.ru_maxrss,
+            "peak_spool_bytes": peak_spool[0],
+            "stored_bytes": dir_usage(self.ws.remote) if not self.ssh_host else None,
+            "user_seconds": round(rusage.ru_utime, 3),
+            "system_seconds": round(rusage.ru_stime, 3),
+        }
+        if not result["ok"]:
+            result["error"] = stderr.decode("utf-8", "replace")[-2000:]
+        return result
+
+    def run(self, selected=None, repeat=1):
+        results = []
+        for case in self.cases():
+            if selected and case[0] not in selected:
+                continue
+            for i in range(repeat):
+                result = self.run_case(*case)
+                print("{name:32} {wall_seconds:>9.2f}s {throughput_mb_s:>9.2f} MB/s "
+                      "rss {peak_rss_kb:>8} KB spool {peak_spool_bytes:>12} B {ok}".format(**result),
+                      file=sys.stderr)
+                results.append(result)
+        return results
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                      stderr=subprocess.DEVNULL)
+        return out.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = {r["name"]: r for r in json.load(f)["results"]}
+
+    metrics = ("wall_seconds", "throughput_mb_s", "peak_rss_kb", "peak_spool_bytes")
+    print("{0:32} ".format("case") + " ".join("{0:>22}".format(m) for m in metrics))
+    for name in sorted(set(before) & set(after)):
+        cells = []
+        for metric in metrics:
+            a, b = before[name][metric], after[name][metric]
+            delta = (b - a) / a * 100 if a else 0
+            cells.append("{0:>22}".format("{0} ({1:+.1f}%)".format(b, delta)))
+        print("{0:32} ".format(name) + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="write json results to this file")
+    parser.add_argument("--scale", type=float, default=1.0, help="data sets size factor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--case", action="append", help="run only this case (can be repeated)")
+    parser.add_argument("--workdir", help="keep data sets on this directory")
+    parser.add_argument("--ssh-host", help="use real scp/ssh against this host")
+    parser.add_argument("--remote-path", default="/tmp/bytehold-bench",
+                        help="remote path used with --ssh-host")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bytehold-bench-")
+    workspace = Workspace(workdir, args.scale, args.seed)
+    if not os.path.exists(workspace.data):
+        workspace.generate()
+
+    try:
+        benchmark = Benchmark(workspace, ssh_host=args.ssh_host, remote_path=args.remote_path)
+        results = benchmark.run(args.case, args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "seed": args.seed,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ import configparser
 from .util import normalized_configfile_path
 from .util import absolute_path
 from .env import Environment
+from .exceptions import InvalidConfiguration
 
 # temporary handlers import
 #from .handlers import FileSystem, Postgresql, MySQL, Tarball
@@ -22,14 +23,32 @@ class BaseBackup(object):
         raise NotImplementedError()
 
     def init(self):
-        for job in self.handlers():
-            job.run()
+        handlers = list(self.handlers())
+        if not handlers:
+            # an empty or unreadable config must not look like a success
+            logging.error("No handlers found on configuration.")
+            return False
+
+        if getattr(self.args, "use_async", False):
+            from .runner import AsyncRunner
+            runner = AsyncRunner(handlers, concurrency=self.args.jobs)
+            return runner.run()
+
+        ok = True
+        for job in handlers:
+            if not job.run_job():
+                ok = False
+        return ok
 
 
 class BackupIni(BaseBackup):
     handler_list = []
 
     def handlers(self): 
+        from .handlers import FileSystem, PostgreSQL, PostgreSQLWAL, MySQL, Tarball
+        handler_list = self.handler_list or [FileSystem, PostgreSQL, PostgreSQLWAL,
+                                             MySQL, Tarball]
+
         config = configparser.ConfigParser()
         config_file_path = absolute_path(self.args.configfile)
         config.read([normalized_configfile_path(config_file_path)]) 
@@ -44,8 +63,8 @@ class BackupIni(BaseBackup):
             if section == 'global':
                 continue
             
-            for handler in self.handler_list:
-                if section.startswith(handler.prefix):
+            for handler in handler_list:
+                if section.split(":", 1)[0] == handler.prefix:
                     try:
                         prefix, name = section.split(":",1)
                     except ValueError:
@@ -64,7 +83,7 @@ class BackupDeclarativePython(BaseBackup):
 
         from .handlers.base import HandlerManager
         parsed = runpy.run_path(config_file_path)
-        for handler in HandlerManager.handlers:
+        for handler in HandlerManager().handlers:
             yield handler
                     
 
@@ -80,13 +99,19 @@ class Main(object):
         # parse logging parameters
         self.parse_verbose(self.args)
 
+        if self.args.action == "restore":
+            return self.parse_restore(self.args)
+
         # check config file
         if self.args.configfile:
-            self.parse_ini_config(self.args)
+            return self.parse_ini_config(self.args)
         elif self.args.python_config:
-            self.parse_python_config(self.args)
+            return self.parse_python_config(self.args)
+        elif self.args.fleet:
+            return self.parse_fleet(self.args)
         else:
             self.parser.print_help()
+            return True
 
     def parse_version(self, args):
         print("{name}: {v[0]}.{v[1]}".format(
@@ -105,8 +130,27 @@ class Main(object):
 
     def parse_ini_config(self, args):
         backup_instance = BackupIni(args)
-        backup_instance.init()
+        return backup_instance.init()
 
     def parse_python_config(self, args):
         backup_instance = BackupDeclarativePython(args)
-        backup_instance.init()
+        return backup_instance.init()
+
+    def parse_restore(self, args):
+        if args.configfile:
+            backup_instance = BackupIni(args)
+        elif args.python_config:
+            backup_instance = BackupDeclarativePython(args)
+        else:
+            self.parser.print_help()
+            return False
+
+        from .restore import Restore
+        restore = Restore(list(backup_instance.handlers()), names=args.handler,
+                          stamp=args.stamp, target=args.target, jobs=args.jobs)
+        return restore.run()
+
+    def parse_fleet(self, args):
+        from .fleet import Fleet
+        fleet = Fleet(args.fleet)
+        return fleet.run()
@@ -2,6 +2,8 @@
 
 import os, socket
 
+from contextlib import contextmanager
+
 from .exceptions import FileDoesNotExists
 from .exceptions import InvalidConfiguration
 
@@ -14,12 +16,31 @@ class Environment(object):
     default_compress_command = resolve_absolute_path('xz', '-z6')
     default_rsync_command = resolve_absolute_path('rsync', '-avr')
     default_scp_command = resolve_absolute_path('scp')
+    default_ssh_command = resolve_absolute_path('ssh')
     default_tar_command = resolve_absolute_path('tar')
+    default_gpg_command = resolve_absolute_path('gpg')
 
     def __new__(cls, *args, **kwargs):
         if cls.instance == None:
-            cls.instance = super(Environment, cls).__new__(cls, *args, **kwargs)
+            cls.instance = super(Environment, cls).__new__(cls)
         return cls.instance
+
+    @classmethod
+    @contextmanager
+    def isolated(cls, **kwargs):
+        """
+        Context manager that replaces global environment with
+        a new one, with its own config. Handlers created inside
+        the block are bound to the isolated environment.
+        """
+        saved_instance = cls.instance
+        instance = super(Environment, cls).__new__(cls)
+        instance.config = dict(kwargs)
+        cls.instance = instance
+        try:
+            yield instance
+        finally:
+            cls.instance = saved_instance
         
     def __init__(self, **kwargs):
         if kwargs:
@@ -30,6 +51,17 @@ class Environment(object):
             self.config['name'] = socket.gethostname()
         return self.config['name']
 
+    def destination(self):
+        """
+        Returns destination type: ``ssh`` (default) for a remote
+        backup host, ``local`` for a local or mounted path or ``s3``
+        for a S3 compatible object storage.
+        """
+        destination = self.config.get("destination", "ssh")
+        if destination not in ("ssh", "local", "s3"):
+            raise InvalidConfiguration("invalid destination: {0}".format(destination))
+        return destination
+
     def remote_host(self):
         if "remote_host" not in self.config:
             raise InvalidConfiguration("remote_host variable does not exist in global scope")
@@ -64,6 +96,29 @@ class Environment(object):
             return self.default_rsync_command()
         return self.config['rsync_command']
 
+    def command_ssh(self):
+        if "ssh_command" not in self.config:
+            return self.default_ssh_command()
+        return self.config['ssh_command']
+
+    def command_gpg(self):
+        if "gpg_command" not in self.config:
+            return self.default_gpg_command()
+        return self.config['gpg_command']
+
+    def encrypt_recipients(self):
+        """
+        Returns a list of gpg public key recipients used for
+        encrypt artifacts, empty if encryption is disabled.
+        """
+        recipients = self.config.get("encrypt_recipients") or []
+        if isinstance(recipients, str):
+            recipients = recipients.split(",")
+        return [recipient.strip() for recipient in recipients if recipient.strip()]
+
+    def upload_streams(self):
+        return int(self.config.get("upload_streams", 1))
+
     def extend(self, **kwargs):
         self.config.update(kwargs)
 
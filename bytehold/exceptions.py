@@ -8,3 +8,8 @@ class InvalidConfiguration(Exception):
 
 class InvalidCompressFormat(Exception):
     pass
+
+class S3Error(Exception):
+    def __init__(self, message, status=None):
+        super(S3Error, self).__init__(message)
+        self.status = status
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import runpy
+import shlex
+import logging
+import argparse
+import threading
+import configparser
+
+from subprocess import Popen, PIPE
+
+from .env import Environment
+from .exceptions import InvalidConfiguration
+from .util import absolute_path
+from .util import normalized_configfile_path
+
+
+class FleetEntry(object):
+    """
+    One environment of a fleet inventory.
+    """
+
+    def __init__(self, name, config, base_path):
+        self.name = name
+        self.base_path = base_path
+        self.ssh_host = config.get("ssh_host")
+        self.configfile = config.get("config")
+        self.python_config = config.get("python_config")
+        self.destination = config.get("destination")
+        self.handlers = []
+
+        if not self.configfile and not self.python_config:
+            raise InvalidConfiguration("env:{0} needs config or python_config.".format(name))
+
+    @property
+    def config_path(self):
+        path = os.path.join(self.base_path, self.configfile or self.python_config)
+        return normalized_configfile_path(path)
+
+    def load(self):
+        """
+        Loads entry configuration on an isolated environment for know
+        the backup destination and the handlers of this environment.
+        """
+        from .base import BackupIni
+        from .handlers.base import HandlerManager
+
+        with Environment.isolated() as env, HandlerManager.isolated() as manager:
+            if self.python_config:
+                runpy.run_path(self.config_path)
+                handlers = manager.handlers
+            else:
+                handlers = BackupIni(argparse.Namespace(configfile=self.config_path)).handlers()
+
+            self.handlers = list(handlers)
+            if not self.handlers:
+                raise InvalidConfiguration("no handlers found on {0}".format(self.config_path))
+
+            if self.destination is None:
+                if env.destination() == "s3":
+                    self.destination = env.config.get("s3_endpoint")
+                elif env.destination() == "local":
+                    self.destination = env.config.get("remote_path")
+                else:
+                    self.destination = env.remote_host()
+
+
+class Fleet(object):
+    """
+    Runs backups of many environments from one controller.
+
+    Inventory is an ini file with a ``fleet`` section for global
+    options and one ``env:{name}`` section for each environment::
+
+        [fleet]
+        concurrency = 20
+        destination_concurrency = 4
+        report = /var/log/bytehold-fleet.json
+
+        [destination:backup1.example.com]
+        concurrency = 2
+
+        [env:db1]
+        ssh_host = root@db1.example.com
+        config = db1.ini
+
+    Config paths are relative to inventory file directory. Each
+    environment config is loaded on an isolated ``Environment``
+    and executed with ``bh`` on ``ssh_host`` (config is sent by stdin
+    and written to a remote temporary file), or locally if ``ssh_host``
+    is not set. At most ``concurrency``
+    environments runs at same time, and at most ``destination_concurrency``
+    for each backup host.
+    """
+
+    default_concurrency = 10
+    default_destination_concurrency = 4
+    default_bh_command = "bh"
+
+    def __init__(self, inventory_path):
+        self.inventory_path = normalized_configfile_path(absolute_path(inventory_path))
+        self.inventory = configparser.ConfigParser()
+        self.inventory.read([self.inventory_path])
+
+        options = self.inventory["fleet"] if "fleet" in self.inventory else {}
+        self.concurrency = int(options.get("concurrency", self.default_concurrency))
+        self.destination_concurrency = int(options.get("destination_concurrency",
+                                                       self.default_destination_concurrency))
+        self.bh_command = options.get("bh_command", self.default_bh_command)
+        self.report_path = options.get("report")
+
+        self.entries = []
+        for section in self.inventory.sections():
+            if section.startswith("env:"):
+                _, name = section.split(":", 1)
+                self.entries.append(FleetEntry(name, self.inventory[section],
+                                               os.path.dirname(self.inventory_path)))
+
+    def destination_limit(self, destination):
+        section = "destination:{0}".format(destination)
+        if section in self.inventory:
+            return int(self.inventory[section].get("concurrency",
+                                                   self.destination_concurrency))
+        return self.destination_concurrency
+
+    def command(self, entry):
+        """
+        Returns command and stdin data for execute an entry.
+        """
+        flag = "-p" if entry.python_config else "-c"
+
+        if entry.ssh_host is None:
+            command = "{bh} {flag} {path}".format(bh=self.bh_command, flag=flag,
+                                                   path=shlex.quote(entry.config_path))
+            return command, None
+
+        # config is copied to a file, python configs can not be readed
+        # from a pipe because are opened twice
+        remote_command = ('config=$(mktemp --suffix={ext}) && cat > "$config" && '
+                          '{{ {bh} {flag} "$config"; rc=$?; rm -f "$config"; exit $rc; }}')
+        remote_command = remote_command.format(
+            ext = ".py" if entry.python_config else ".ini",
+            bh = self.bh_command,
+            flag = flag,
+        )
+        command = "{ssh} {host} {remote_command}".format(
+            ssh = Environment().command_ssh(),
+            host = entry.ssh_host,
+            remote_command = shlex.quote(remote_command),
+        )
+
+        with open(entry.config_path, "rb") as f:
+            return command, f.read()
+
+    def execute(self, entry):
+        """
+        Executes backup of one entry and returns a report.
+        """
+        report = {"name": entry.name, "destination": entry.destination,
+                  "handlers": len(entry.handlers), "ok": False, "returncode": None}
+
+        start = time.time()
+        command, stdin = self.command(entry)
+        logging.info("Fleet - %s - exec: %s", entry.name, command)
+
+        try:
+            with Popen(shlex.split(command), stdin=PIPE, stdout=PIPE, stderr=PIPE) as p:
+                out, err = p.communicate(stdin)
+        except OSError as e:
+            report["error"] = str(e)
+        else:
+            report["returncode"] = p.returncode
+            report["ok"] = p.returncode == 0
+            if not report["ok"]:
+                report["error"] = err.decode("utf-8", "replace")[-2000:]
+
+        report["seconds"] = round(time.time() - start, 1)
+        return report
+
+    def run(self):
+        """
+        Runs all entries respecting global and per destination
+        concurrency limits and returns True if all are success.
+        """
+        reports, pending = [], []
+
+        for entry in self.entries:
+            try:
+                entry.load()
+            except Exception as e:
+                error = "failed loading configuration: {0}: {1}".format(e.__class__.__name__, e)
+                reports.append({"name": entry.name, "destination": entry.destination,
+                                "ok": False, "returncode": None, "error": error})
+            else:
+                pending.append(entry)
+
+        condition = threading.Condition()
+        running = {}
+
+        def worker(entry):
+            report = {"name": entry.name, "destination": entry.destination,
+                      "handlers": len(entry.handlers), "ok": False, "returncode": None}
+            try:
+                report = self.execute(entry)
+            except Exception as e:
+                report["error"] = "{0}: {1}".format(e.__class__.__name__, e)
+            finally:
+                with condition:
+                    reports.append(report)
+                    running[entry.destination] -= 1
+                    condition.notify_all()
+
+        threads = []
+        with condition:
+            while pending:
+                total = sum(running.values())
+                entry = None
+                if total < self.concurrency:
+                    for candidate in pending:
+                        if running.get(candidate.destination, 0) < \
+                                self.destination_limit(candidate.destination):
+                            entry = candidate
+                            break
+
+                if entry is None:
+                    condition.wait()
+                    continue
+
+                pending.remove(entry)
+                running[entry.destination] = running.get(entry.destination, 0) + 1
+                thread = threading.Thread(target=worker, args=(entry,))
+                thread.start()
+                threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        self.print_report(reports)
+        return all(report["ok"] for report in reports)
+
+    def print_report(self, reports):
+        reports = sorted(reports, key=lambda x: x["name"])
+
+        for report in reports:
+            print("{status:6} {name:30} {destination:30} {seconds:>8}s".format(
+                status = "OK" if report["ok"] else "FAILED",
+                name = report["name"],
+                destination = str(report["destination"]),
+                seconds = report.get("seconds", 0),
+            ))
+            if not report["ok"]:
+                logging.error("Fleet - %s - %s", report["name"], report.get("error", "").strip())
+
+        failed = len([x for x in reports if not x["ok"]])
+        print("{0} environments, {1} failed.".format(len(reports), failed))
+
+        if self.report_path:
+            with open(self.report_path, "w") as f:
+                json.dump(reports, f, indent=2)
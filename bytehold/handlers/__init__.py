@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from .db import PostgreSQL, MySQL
+from .db import PostgreSQL, PostgreSQLWAL, MySQL
 from .fs import FileSystem, Tarball
 
-__all__ = ['Postgresql', 'FileSystem', 'MySQL', 'Tarball']
+__all__ = ['Postgresql', 'PostgreSQLWAL', 'FileSystem', 'MySQL', 'Tarball']
 
@@ -1,19 +1,36 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import shlex
+import queue
+import signal
+import asyncio
+import time
 import shutil
+import hashlib
+import json
+import uuid
 import logging
 import datetime
 import tempfile
+import threading
 
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL
 from contextlib import contextmanager
 
 from ..env import Environment
 from ..exceptions import FileDoesNotExists
 from ..exceptions import InvalidConfiguration
 from ..exceptions import InvalidCompressFormat
+from ..exceptions import S3Error
+from ..util import parse_size
+from ..util import copy_file
+from ..util import resolve_absolute_path
+from ..supervisor import Supervisor
+from ..s3 import S3Client
+from ..retention import artifact_stamp
+from ..retention import select_expired
 
 
 @contextmanager
@@ -30,9 +47,25 @@ class HandlerManager(object):
 
     def __new__(cls, *args, **kwargs):
         if cls.instance == None:
-            cls.instance = super(HandlerManager, cls).__new__(cls, *args, **kwargs)
+            cls.instance = super(HandlerManager, cls).__new__(cls)
         return cls.instance
 
+    @classmethod
+    @contextmanager
+    def isolated(cls):
+        """
+        Context manager that replaces global handler manager with
+        a new one, with its own list of handlers.
+        """
+        saved_instance = cls.instance
+        instance = super(HandlerManager, cls).__new__(cls)
+        instance.handlers = []
+        cls.instance = instance
+        try:
+            yield instance
+        finally:
+            cls.instance = saved_instance
+
     def register(self, handler):
         if isinstance(handler, BaseHandler):
             self.handlers.append(handler)
@@ -45,7 +78,31 @@ class BaseHandler(object):
 
     _scheduled_for_delete = []
 
+    default_upload_workers = 2
+    default_spool_volumes = 2
+    stream_chunk_size = 1024 * 1024
+    parallel_upload_min_size = 64 * 1024 * 1024
+
+    nice_command = resolve_absolute_path('nice')
+    sh_command = resolve_absolute_path('sh')
+    ionice_command = resolve_absolute_path('ionice')
+    ionice_classes = {"realtime": "1", "best-effort": "2", "idle": "3"}
+
+    index_name = ".bytehold-index"
+    encryption_ext = ".gpg"
+    keys_suffix = ".keys.json"
+    retention_options = ("keep_daily", "keep_weekly", "keep_monthly")
+
+    decompress_commands = {
+        ".xz": "xz -dc",
+        ".gz": "gzip -dc",
+        ".bz2": "bzip2 -dc",
+    }
+
     def __init__(self, name='anonymous', auto_register=True, **kwargs):
+        self._scheduled_for_delete = []
+        self._s3 = None
+        self.deadline = None
         self.name = name
         self.config = kwargs
         self.env = Environment()
@@ -60,6 +117,12 @@ class BaseHandler(object):
         On class is destroyed, delete all schedules files for
         deletion.
         """
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Delete all files scheduled for deletion.
+        """
         logging.debug("%s - cleaning.", self.handler_name)
         for path in set(self._scheduled_for_delete):
             if os.path.exists(path):
@@ -68,6 +131,7 @@ class BaseHandler(object):
                     os.remove(path)
                 else:
                     shutil.rmtree(path)
+        self._scheduled_for_delete = []
 
     def sched_for_delete(self, path):
         self._scheduled_for_delete.append(path)
@@ -86,6 +150,15 @@ class BaseHandler(object):
         """
         pass
     
+    def option(self, name, default=None):
+        """
+        Returns a handler option, that can be set on handler
+        config or globally on environment.
+        """
+        if name in self.config:
+            return self.config[name]
+        return self.env.config.get(name, default)
+
     def run(self):
         """
         This is a main method in handler execution.
@@ -93,20 +166,202 @@ class BaseHandler(object):
         """
         raise NotImplementedError()
 
-    def execute(self, command, stdout=PIPE, stderr=PIPE, okreturncode=0):
+    def run_job(self):
+        """
+        Runs handler with ``timeout`` seconds wall clock deadline. If it
+        fails (or raises an exception), local temporary files are deleted
+        and it is retried ``retries`` times, waiting ``retry_delay`` seconds
+        doubled on each retry.
+        """
+        timeout = self.option("timeout")
+        retries = int(self.option("retries", 0))
+        retry_delay = float(self.option("retry_delay", 60))
+
+        for attempt in range(retries + 1):
+            if timeout is not None:
+                self.deadline = time.time() + float(timeout)
+
+            try:
+                ok = self.run()
+            except Exception:
+                logging.exception("%s - error (%s).", self.handler_name, self.name)
+                ok = False
+            finally:
+                self.deadline = None
+
+            if ok:
+                self.prune_job()
+                return True
+
+            self.cleanup()
+            if attempt < retries:
+                delay = retry_delay * 2 ** attempt
+                logging.error("%s - failed (%s), retrying in %s seconds.",
+                              self.handler_name, self.name, delay)
+                time.sleep(delay)
+
+        logging.error("%s - failed (%s).", self.handler_name, self.name)
+        return False
+
+    def prune_job(self):
+        """
+        Runs ``prune`` after a success backup. Failures of
+        retention does not fail the backup.
+        """
+        try:
+            self.prune()
+        except Exception:
+            logging.exception("%s - error pruning artifacts (%s).", self.handler_name, self.name)
+
+    def supervised(self):
+        """
+        Returns True if commands must be executed with a deadline,
+        stall detection or host pressure regulation.
+        """
+        return (self.deadline is not None or self.option("stall_timeout") is not None
+                or self.option("pressure_high") is not None)
+
+    def supervise(self, procs):
+        """
+        Starts and returns a supervisor for ``procs`` or None
+        if handler has no deadline nor stall timeout.
+        """
+        if not self.supervised():
+            return None
+
+        stall_timeout = self.option("stall_timeout")
+        if stall_timeout is not None:
+            stall_timeout = float(stall_timeout)
+
+        pressure = None
+        if self.option("pressure_high") is not None:
+            high = float(self.option("pressure_high"))
+            pressure = (high, float(self.option("pressure_low", high / 2)))
+
+        supervisor = Supervisor(procs, deadline=self.deadline, stall_timeout=stall_timeout,
+                                pressure=pressure, name=self.handler_name)
+        supervisor.start()
+        return supervisor
+
+    def restore(self, stamp=None, target=None):
+        """
+        Restores newest artifact (or artifact with ``stamp``
+        timestamp) on ``target``. Must be reimplemented on a
+        subclass that supports restore.
+        """
+        raise NotImplementedError()
+
+    def priority_prefix(self):
+        """
+        Returns a list of arguments prefixed to all commands for
+        run them with ``nice`` and ``ionice`` options.
+        """
+        prefix = []
+
+        nice = self.option("nice")
+        if nice is not None:
+            prefix.extend([self.nice_command(), "-n", str(nice)])
+
+        ionice = self.option("ionice")
+        if ionice is not None:
+            ioclass, _, level = str(ionice).partition(":")
+            ioclass = self.ionice_classes.get(ioclass, ioclass)
+            prefix.extend([self.ionice_command(), "-c", ioclass])
+            if level:
+                prefix.extend(["-n", level])
+
+        return prefix
+
+    def setup_cgroup(self):
+        """
+        Creates ``cgroup`` (a cgroup v2 directory) if not exists and
+        sets its ``cpu_weight`` and ``io_weight``. Returns cgroup path
+        or None if is not configured or can not be used.
+        """
+        cgroup = self.option("cgroup")
+        if cgroup is None:
+            return None
+
+        try:
+            if not os.path.exists(cgroup):
+                os.makedirs(cgroup)
+
+            for option, fname in (("cpu_weight", "cpu.weight"), ("io_weight", "io.weight")):
+                if self.option(option) is not None:
+                    with open(os.path.join(cgroup, fname), "w") as f:
+                        f.write(str(self.option(option)))
+        except (IOError, OSError) as e:
+            logging.error("%s - can not setup cgroup %s: %s", self.handler_name, cgroup, e)
+            return None
+
+        return cgroup
+
+    def process_args(self, command, kwargs):
+        """
+        Returns arguments list and updated ``Popen`` keyword
+        arguments for start a command with handler priority settings.
+
+        Commands join ``cgroup`` with a shell wrapper that writes its pid
+        to cgroup and is replaced by command, because ``preexec_fn`` is
+        not safe with threads. If cgroup can not be joined, command is
+        not executed and fails.
+        """
+        args = self.priority_prefix() + shlex.split(command)
+
+        cgroup = self.setup_cgroup()
+        if cgroup is not None:
+            script = 'echo $$ > {0} && exec "$@"'.format(
+                shlex.quote(os.path.join(cgroup, "cgroup.procs")))
+            args = [self.sh_command(), "-c", script, "sh"] + args
+
+        return args, kwargs
+
+    def popen(self, command, supervised=True, **kwargs):
         """
-        Execute command and return True if is success.
+        Starts a command with handler priority settings. Supervised
+        commands are started on a new session.
         """
-        with Popen(shlex.split(command), stdout=stdout, stderr=stderr) as p:
+        kwargs.setdefault("start_new_session", supervised and self.supervised())
+        args, kwargs = self.process_args(command, kwargs)
+        return Popen(args, **kwargs)
+
+    def execute(self, command, stdout=PIPE, stderr=PIPE, okreturncode=0, supervised=True):
+        """
+        Execute command and return True if is success. If ``supervised``
+        command is terminated on handler deadline or stall timeout.
+        """
+        supervised = supervised and self.supervised()
+        with self.popen(command, supervised=supervised, stdout=stdout, stderr=stderr) as p:
+            supervisor = self.supervise([p]) if supervised else None
             self.print_output(p.communicate())
             returncode = p.returncode
 
+        if supervisor is not None and not supervisor.finish():
+            return False
+
         return returncode == okreturncode
 
     def compress(self, path):
         """
-        This execute a compress comand for path.
+        This execute a compress comand for path. If encryption is
+        enabled, compressor output is encrypted while is written.
         """
+        encryption_command = self.encryption_command()
+        if encryption_command is not None:
+            compressed_path = "{0}.xz{1}".format(path, self.encryption_ext)
+            command = "{command} -c {path}".format(
+                command = self.env.command_compress(),
+                path = path,
+            )
+
+            if self.run_to_file([command, encryption_command], compressed_path):
+                os.remove(path)
+                return True, compressed_path
+
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+            return False, path
+
         command = "{command} {path}".format(
             command = self.env.command_compress(),
             path = path,
@@ -119,7 +374,7 @@ class BaseHandler(object):
             return True, "{0}.xz".format(path)
         return False, path
 
-    def tar(self, base_path, paths, tar_name, compress_format=None):
+    def tar(self, base_path, paths, tar_name, compress_format=None, encrypt=False):
         """
         This execute a compress comand for path.
         
@@ -132,15 +387,41 @@ class BaseHandler(object):
         - ``compress_format`` is a compression format for a tarball, is is None, no compression
           used. Posible values are xz, bzip2 or gzip.
 
+        - ``encrypt``: if is True and encryption is enabled, tarball is encrypted while
+          is written.
+
         """
 
-        if isinstance(paths, str):
-            if paths != "*":
-                paths="'"+paths+"'"
+        _, ext = self.tar_flags(compress_format)
 
-        elif isinstance(paths, (list, tuple)):
-            paths="'"+"' '".join(paths)+"'"
-       
+        tmpdir = tempfile.mkdtemp()
+        self.sched_for_delete(tmpdir)
+
+        tar_path = os.path.join(tmpdir, "{name}.{ext}".format(name=tar_name, ext=ext))
+
+        encryption_command = self.encryption_command() if encrypt else None
+        if encryption_command is not None:
+            tar_path += self.encryption_ext
+            command = self.tar_command(base_path, paths, "-", compress_format)
+            ok = self.run_to_file([command, encryption_command], tar_path)
+            if ok:
+                return True, tar_path
+            return False, None
+
+        command = self.tar_command(base_path, paths, tar_path, compress_format)
+            
+        logging.info("%s - exec: %s", self.handler_name, command)
+        ok = self.execute(command)
+        
+        if ok:
+            return True, tar_path
+        return False, None
+
+    def tar_flags(self, compress_format=None):
+        """
+        Returns a tuple with tar flags and resultant file
+        extension for a compression format.
+        """
         flags, ext = "cv{extra}", "tar"
         if compress_format is not None:
             if compress_format == 'xz':
@@ -157,25 +438,255 @@ class BaseHandler(object):
 
         else:
             flags = flags.format(extra='')
-        
-        tmpdir = tempfile.mkdtemp()
-        self.sched_for_delete(tmpdir)
 
-        tar_path = os.path.join(tmpdir, "{name}.{ext}".format(name=tar_name, ext=ext))
-        command = "{command} -{flags} -f {tar_path} -C {base_path} {paths}".format(
+        return flags, ext
+
+    def tar_command(self, base_path, paths, tar_path, compress_format=None):
+        """
+        Returns a tar command. Parameters are same as ``tar`` method
+        and ``tar_path`` is a resultant file path or '-' for stdout.
+        """
+
+        if isinstance(paths, str):
+            if paths != "*":
+                paths="'"+paths+"'"
+
+        elif isinstance(paths, (list, tuple)):
+            paths="'"+"' '".join(paths)+"'"
+
+        flags, _ = self.tar_flags(compress_format)
+        return "{command} -{flags} -f {tar_path} -C {base_path} {paths}".format(
             command = self.env.command_tar(),
             flags = flags,
             tar_path = tar_path,
             base_path = base_path,
             paths = paths,
         )
-            
-        logging.info("%s - exec: %s", self.handler_name, command)
-        ok = self.execute(command)
-        
-        if ok:
-            return True, tar_path
-        return False, None
+
+    def encryption_command(self):
+        """
+        Returns a gpg command that encrypts stdin to stdout for environment
+        ``encrypt_recipients`` or None if encryption is disabled. Data is
+        compressed before, so gpg compression is disabled.
+        """
+        recipients = self.env.encrypt_recipients()
+        if not recipients:
+            return None
+
+        return ("{command} --batch --yes --trust-model always --compress-algo none "
+                "--encrypt {recipients}").format(
+            command = self.env.command_gpg(),
+            recipients = " ".join("--recipient {0}".format(shlex.quote(recipient))
+                                  for recipient in recipients),
+        )
+
+    def encrypted(self, commands, name):
+        """
+        Returns commands pipeline and artifact name with a
+        encryption stage if encryption is enabled.
+        """
+        encryption_command = self.encryption_command()
+        if encryption_command is None:
+            return commands, name
+        return commands + [encryption_command], name + self.encryption_ext
+
+    def artifact_ext(self, path):
+        """
+        Returns extension of a local artifact file, including the
+        previous extension of encrypted files (like ``.xz.gpg``).
+        """
+        root, ext = os.path.splitext(path)
+        if ext == self.encryption_ext:
+            return os.path.splitext(root)[1] + ext
+        return ext
+
+    def run_to_file(self, commands, path):
+        """
+        Runs commands pipeline writing output to ``path``
+        and return True if is success.
+        """
+        with open(path, "wb") as f:
+            procs = self.pipeline(commands, stdout=f)
+        return self.wait_pipeline(procs)
+
+    def pipeline(self, commands, stdout=PIPE, stdin=None):
+        """
+        Start all commands chained with pipes and return a list of
+        processes. Stdin of first command is ``stdin`` and stdout
+        of last command is ``stdout``.
+        """
+        procs = []
+        for i, command in enumerate(commands):
+            logging.info("%s - exec: %s", self.handler_name, command)
+
+            last = i == len(commands) - 1
+            stderr = tempfile.TemporaryFile()
+            p = self.popen(command, stdin=stdin, stdout=stdout if last else PIPE, stderr=stderr)
+            p.stderr_log = stderr
+            if procs:
+                # only child process needs the pipe
+                stdin.close()
+            stdin = p.stdout
+            procs.append(p)
+
+        supervisor = self.supervise(procs)
+        for p in procs:
+            p.supervisor = supervisor
+
+        return procs
+
+    def wait_pipeline(self, procs, okreturncode=0):
+        """
+        Wait all pipeline processes and return True if all are success.
+        """
+        ok = True
+        for p in procs:
+            p.wait()
+            if p.stdout is not None:
+                p.stdout.close()
+            p.stderr_log.seek(0)
+            self.print_output((None, p.stderr_log.read()))
+            p.stderr_log.close()
+            ok = ok and p.returncode == okreturncode
+
+        supervisor = procs[0].supervisor
+        if supervisor is not None and not supervisor.finish():
+            return False
+        return ok
+
+    def volume_size(self):
+        """
+        Returns configured volume size in bytes or None if
+        artifacts must not be splitted.
+        """
+        if not self.config.get("volume_size"):
+            return None
+        return parse_size(self.config["volume_size"])
+
+    def stream_volumes(self, stream, final_name, finished=None):
+        """
+        Reads ``stream`` and cuts it on fixed size volumes. Each volume is
+        uploaded as soon as is complete, while next volumes are produced,
+        and deleted when upload finishes. At most ``spool_volumes`` finished
+        volumes waits for upload on local disk.
+
+        When all volumes are uploaded and ``finished`` callable (if any)
+        confirms that stream producer is success, a manifest with sha256
+        checksums (compatible with ``sha256sum -c``) is uploaded as
+        ``{final_name}.manifest``. On failure uploaded volumes are removed.
+        """
+        volume_size = self.volume_size()
+        workers = int(self.config.get("upload_workers", self.default_upload_workers))
+        spool = int(self.config.get("spool_volumes", self.default_spool_volumes))
+
+        # bandwidth limit is shared by all workers
+        bwlimit = self.bwlimit() / workers if self.bwlimit() else None
+
+        tmpdir = tempfile.mkdtemp()
+        self.sched_for_delete(tmpdir)
+
+        pending = queue.Queue(maxsize=spool)
+        failed = threading.Event()
+        uploaded = []
+
+        def upload():
+            # workers never stop before the end of queue, otherwise
+            # producer would be blocked forever on a full queue
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+
+                path, name = item
+                try:
+                    if failed.is_set():
+                        continue
+                    if self.scp_put(path, name, bwlimit=bwlimit):
+                        uploaded.append(name)
+                    else:
+                        logging.error("%s - failed scp of volume %s.", self.handler_name, name)
+                        failed.set()
+                except Exception as e:
+                    logging.error("%s - failed scp of volume %s: %s: %s", self.handler_name,
+                                  name, e.__class__.__name__, e)
+                    # volume can be partially uploaded
+                    uploaded.append(name)
+                    failed.set()
+                finally:
+                    os.remove(path)
+
+        threads = [threading.Thread(target=upload) for x in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        manifest, index, eof = [], 0, False
+        try:
+            while not eof and not failed.is_set():
+                index += 1
+                name = "{0}.vol{1:04d}".format(final_name, index)
+                path = os.path.join(tmpdir, name)
+                checksum, written = hashlib.sha256(), 0
+
+                with open(path, "wb") as f:
+                    while written < volume_size:
+                        chunk = stream.read(min(self.stream_chunk_size, volume_size - written))
+                        if not chunk:
+                            eof = True
+                            break
+                        f.write(chunk)
+                        checksum.update(chunk)
+                        written += len(chunk)
+
+                if written == 0 and index > 1:
+                    os.remove(path)
+                    break
+
+                manifest.append("{0}  {1}\n".format(checksum.hexdigest(), name))
+                pending.put((path, name))
+        finally:
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+        if not failed.is_set() and finished is not None and not finished():
+            failed.set()
+
+        if failed.is_set():
+            self.remove_remote(uploaded)
+            return False
+
+        manifest_path = os.path.join(tmpdir, "{0}.manifest".format(final_name))
+        with open(manifest_path, "w") as f:
+            f.writelines(manifest)
+
+        if not self.scp_put_atomic(manifest_path, os.path.basename(manifest_path)):
+            return False
+
+        self.record_artifact(final_name, uploaded + [os.path.basename(manifest_path)])
+        return True
+
+    def put_volumes(self, commands, final_name):
+        """
+        Runs commands pipeline and uploads their output
+        splitted on volumes.
+        """
+        procs = self.pipeline(commands)
+        results = []
+
+        def finished():
+            results.append(self.wait_pipeline(procs))
+            return results[0]
+
+        ok = self.stream_volumes(procs[-1].stdout, final_name, finished)
+        if not results:
+            # volumes upload failed before the end of stream
+            for p in procs:
+                if p.poll() is None:
+                    p.kill()
+            self.wait_pipeline(procs)
+
+        return ok
 
     def print_output(self, output):
         """
@@ -188,34 +699,1132 @@ class BaseHandler(object):
         if output[1]:
             logging.debug("stderr: %s", output[1].decode('utf-8'))
 
+    def artifact_handler_name(self):
+        """
+        Returns handler name with only safe characters
+        for use on artifact names.
+        """
+        return re.sub(r'[^\w-]+', '_', self.name)
+
+    def artifact_name(self, suffix):
+        """
+        Returns name of a new artifact: ``{env}.{stamp}.{handler}.{suffix}``.
+        Handler name is part of the name, so artifacts of different handlers
+        of same type are never mixed.
+        """
+        return "{name}.{stamp}.{handler}.{suffix}".format(
+            name = self.env.name(),
+            stamp = self.timestamp(),
+            handler = self.artifact_handler_name(),
+            suffix = suffix,
+        )
+
+    def artifact_rx(self, suffix, legacy=False):
+        """
+        Returns a regular expression that matches artifacts of current
+        environment and handler with ``suffix`` after handler name.
+
+        With ``legacy``, it matches artifacts named before handler name
+        was part of artifact names: ``{env}.{stamp}.{suffix}``.
+        """
+        if legacy:
+            rx = r"^{name}\.(?P<stamp>\d{{4}}-\d{{2}}-\d{{2}}_\d{{4}})\.{suffix}$"
+        else:
+            rx = r"^{name}\.(?P<stamp>\d{{4}}-\d{{2}}-\d{{2}}_\d{{4}})\.{handler}\.{suffix}$"
+        return re.compile(rx.format(
+            name = re.escape(self.env.name()),
+            handler = re.escape(self.artifact_handler_name()),
+            suffix = suffix,
+        ))
+
     def timestamp(self):
         """
         Returns current timestamp.
         """
         return datetime.datetime.now().strftime("%Y-%m-%d_%H%M")
     
-    def scp_put(self, local_path, final_name):
+    def upload_streams(self):
+        """
+        Returns number of concurrent streams used for upload
+        one file. Handler option overrides environment one.
+        """
+        return int(self.config.get("upload_streams", self.env.upload_streams()))
+
+    def scp_put(self, local_path, final_name, streams=None, bwlimit=None):
         """
         Put local file to backup host.
+
+        If ``streams`` (by default ``upload_streams`` option) is greater than 1
+        and file is large enough, file is uploaded with concurrent ssh streams.
+        ``bwlimit`` (by default ``bwlimit`` option) is the bandwidth limit
+        in KB/s of this upload.
         """
-        scp_command = "{command} {path} {host}:{remote_path}/{final_name}"
-        scp_command = scp_command.format(
+        if self.env.destination() == "local":
+            return self.local_put(local_path, final_name)
+
+        if self.env.destination() == "s3":
+            return self.s3_put(local_path, final_name)
+
+        if streams is None:
+            streams = self.upload_streams()
+
+        if streams > 1 and os.path.getsize(local_path) >= self.parallel_upload_min_size:
+            return self.scp_put_parallel(local_path, final_name, streams, bwlimit)
+
+        scp_command = self.scp_command(local_path, final_name, bwlimit)
+        logging.info("%s - exec: %s", self.handler_name, scp_command)
+        ok = self.execute(scp_command)
+        if not ok:
+            self.remove_remote([final_name])
+        return ok
+
+    def scp_command(self, local_path, final_name, bwlimit=None):
+        """
+        Returns scp command for put local file to backup host, with
+        ``bwlimit`` (by default ``bwlimit`` option) in KB/s.
+        """
+        bwlimit = bwlimit or self.bwlimit()
+        scp_command = "{command} {limit}{path} {host}:{remote_path}/{final_name}"
+        return scp_command.format(
             command = self.env.command_scp(),
+            # scp limit is in Kbit/s
+            limit = "-l {0} ".format(max(1, int(bwlimit * 8))) if bwlimit else "",
             path = local_path,
             host = self.env.remote_host(),
             remote_path = self.env.remote_path(),
             final_name = final_name,
         )
 
-        logging.info("%s - exec: %s", self.handler_name, scp_command)
-        return self.execute(scp_command)
+    def remove_remote(self, names):
+        """
+        Removes partial artifacts from backup host. Is not
+        affected by handler deadline.
+        """
+        if not names:
+            return True
 
-    def rsync(self, path):
-        command_str = "{command} {path} {host}:{remote_path}".format(
-            command = self.env.command_rsync(), 
-            path = path,
+        if self.env.destination() == "s3":
+            try:
+                self.s3().delete_objects(self.s3_key(name) for name in names)
+            except S3Error as e:
+                logging.error("%s - failed removing %s: %s", self.handler_name, names, e)
+                return False
+            return True
+
+        remote_path = self.env.remote_path()
+        return self.ssh("rm -f {0}".format(
+            " ".join(shlex.quote(os.path.join(remote_path, name)) for name in names)),
+            supervised=False)
+
+    def retention_key(self):
+        """
+        Returns the key of handler artifacts on index.
+        """
+        return "{0}:{1}".format(getattr(self, "prefix", self.handler_name.lower()), self.name)
+
+    def index_path(self):
+        return os.path.join(self.env.remote_path(), self.index_name)
+
+    def s3_index_key(self):
+        """
+        Returns key of artifacts index on s3 destination. Each handler
+        has its own index object, only written by its executions.
+        """
+        return self.s3_key("{0}.{1}".format(self.index_name,
+                                            re.sub(r'[^\w-]+', '_', self.retention_key())))
+
+    def s3_write_index(self, entries):
+        """
+        Replaces handler index object of s3 destination with ``entries``.
+        """
+        data = "".join("\t".join([stamp, key] + files) + "\n" for stamp, key, files in entries)
+        self.s3().put_object(self.s3_index_key(), data.encode("utf-8"))
+
+    def index_command(self, command):
+        """
+        Returns a command that executes a shell command on backup
+        host with artifacts index locked.
+        """
+        return self.ssh_command("flock {lock} -c {command}".format(
+            lock = shlex.quote("{0}.lock".format(self.index_path())),
+            command = shlex.quote(command),
+        ))
+
+    def record_artifact(self, final_name, files=None):
+        """
+        Appends an uploaded artifact with all its files (by default only
+        ``final_name``) to artifacts index of backup host. Index is a text
+        file with one line by artifact, with timestamp, handler key and
+        files separated by tabs.
+
+        Encryption keys of encrypted artifacts are uploaded before
+        as ``{final_name}.keys.json``.
+        """
+        files = list(files or [final_name])
+        if final_name.endswith(self.encryption_ext):
+            if self.put_encryption_keys(final_name):
+                files.append(final_name + self.keys_suffix)
+            else:
+                logging.error("%s - failed uploading encryption keys of %s.",
+                              self.handler_name, final_name)
+
+        stamp = artifact_stamp(final_name)
+        if stamp is None:
+            return True
+
+        if self.env.destination() == "s3":
+            return self.s3_record_artifact(stamp, files)
+
+        line = "\t".join([stamp, self.retention_key()] + files)
+        command = self.index_command("printf '%s\\n' {line} >> {index}".format(
+            line = shlex.quote(line),
+            index = shlex.quote(self.index_path()),
+        ))
+
+        logging.info("%s - exec: %s", self.handler_name, command)
+        ok = self.execute(command, supervised=False)
+        if not ok:
+            logging.error("%s - failed updating artifacts index with %s.",
+                          self.handler_name, final_name)
+        return ok
+
+    def s3_record_artifact(self, stamp, files):
+        """
+        Appends an uploaded artifact to handler index object
+        of s3 destination.
+        """
+        entries = self.read_index()
+        if entries is None:
+            logging.error("%s - failed reading artifacts index.", self.handler_name)
+            return False
+
+        try:
+            self.s3_write_index(entries + [(stamp, self.retention_key(), files)])
+        except S3Error as e:
+            logging.error("%s - failed updating artifacts index: %s", self.handler_name, e)
+            return False
+        return True
+
+    def encryption_keys(self):
+        """
+        Returns a list with recipients of encrypted artifacts, their
+        primary key fingerprint and fingerprints of encryption subkeys
+        (key ids on encrypted artifacts headers) from local keyring.
+        """
+        keys = []
+        for recipient in self.env.encrypt_recipients():
+            command = "{0} --batch --with-colons --with-subkey-fingerprint --list-keys {1}".format(
+                self.env.command_gpg(), shlex.quote(recipient))
+            with self.popen(command, stdout=PIPE, stderr=PIPE) as p:
+                out, err = p.communicate()
+
+            key = {"recipient": recipient, "fingerprint": None, "encryption_subkeys": []}
+            record = None
+            for line in out.decode("utf-8", "replace").splitlines():
+                fields = line.split(":")
+                if fields[0] in ("pub", "sub"):
+                    record = fields
+                elif fields[0] == "fpr" and record is not None:
+                    if record[0] == "pub" and key["fingerprint"] is None:
+                        key["fingerprint"] = fields[9]
+                    if len(record) > 11 and "e" in record[11]:
+                        key["encryption_subkeys"].append(fields[9])
+                    record = None
+            keys.append(key)
+        return keys
+
+    def put_encryption_keys(self, final_name):
+        """
+        Uploads a ``{final_name}.keys.json`` file with the encryption
+        recipients and keys of an encrypted artifact.
+        """
+        tmpdir = tempfile.mkdtemp()
+        self.sched_for_delete(tmpdir)
+
+        keys_name = final_name + self.keys_suffix
+        path = os.path.join(tmpdir, keys_name)
+        with open(path, "w") as f:
+            json.dump({"artifact": final_name, "format": "openpgp",
+                       "recipients": self.encryption_keys()}, f, indent=2)
+
+        return self.scp_put_atomic(path, keys_name)
+
+    def read_remote(self, name):
+        """
+        Returns tuple when the first element is boolean and second
+        the content of a file of backup host or s3 destination.
+        """
+        if self.env.destination() == "s3":
+            try:
+                return True, self.s3().get_object(self.s3_key(name)).read().decode("utf-8")
+            except S3Error as e:
+                logging.error("%s - failed reading %s: %s", self.handler_name, name, e)
+                return False, ''
+
+        return self.ssh_output("cat {0}".format(
+            shlex.quote(os.path.join(self.env.remote_path(), name))))
+
+    def check_decryption_keys(self, artifact):
+        """
+        Checks that local keyring has a secret key for decrypt an
+        encrypted artifact, using its keys file. Returns True if keys
+        file can not be readed (gpg will search the key itself).
+        """
+        ok, out = self.read_remote(self.artifact_base(artifact) + self.keys_suffix)
+        try:
+            recipients = json.loads(out)["recipients"] if ok else None
+        except (ValueError, KeyError):
+            recipients = None
+
+        if not recipients:
+            logging.info("%s - encryption keys of %s not found.", self.handler_name, artifact)
+            return True
+
+        for key in recipients:
+            for fingerprint in key["encryption_subkeys"] + [key["fingerprint"]]:
+                if not fingerprint:
+                    continue
+                command = "{0} --batch --list-secret-keys {1}".format(
+                    self.env.command_gpg(), fingerprint)
+                if self.execute(command, supervised=False):
+                    logging.info("%s - decrypting %s with key %s (%s).", self.handler_name,
+                                 artifact, fingerprint, key["recipient"])
+                    return True
+
+        logging.error("%s - no secret key for %s, encrypted for: %s", self.handler_name, artifact,
+                      ", ".join("{0} ({1})".format(key["recipient"], key["fingerprint"])
+                                for key in recipients))
+        return False
+
+    def read_index(self):
+        """
+        Returns a list of (stamp, key, files) tuples from artifacts
+        index of backup host (or handler index object of s3 destination),
+        or None if it can not be readed.
+        """
+        if self.env.destination() == "s3":
+            try:
+                response = self.s3().get_object(self.s3_index_key())
+                try:
+                    out = response.read().decode("utf-8")
+                finally:
+                    response.close()
+            except S3Error as e:
+                if e.status != 404:
+                    logging.error("%s - failed reading artifacts index: %s", self.handler_name, e)
+                    return None
+                out = ""
+        else:
+            ok, out = self.ssh_output("cat {0} 2>/dev/null || true".format(
+                shlex.quote(self.index_path())))
+            if not ok:
+                return None
+
+        entries = []
+        for line in out.splitlines():
+            fields = line.split("\t")
+            if len(fields) >= 3:
+                entries.append((fields[0], fields[1], fields[2:]))
+        return entries
+
+    def prune(self):
+        """
+        Deletes handler artifacts expired by ``keep_daily``, ``keep_weekly``
+        and ``keep_monthly`` options. Expired artifacts are selected from
+        index, and deleted and removed from index with one remote command,
+        so backup host directory is never listed. On s3 destination they
+        are selected from handler index object.
+        """
+        policy = dict((option, self.option(option)) for option in self.retention_options)
+        if not any(policy.values()):
+            return True
+
+        index_entries = self.read_index()
+        if index_entries is None:
+            logging.error("%s - failed reading artifacts index.", self.handler_name)
+            return False
+
+        key = self.retention_key()
+        entries = [entry for entry in index_entries if entry[1] == key]
+        expired = set(select_expired([stamp for stamp, _, _ in entries], **policy))
+        entries = [entry for entry in entries if entry[0] in expired]
+        if not entries:
+            return True
+
+        if self.env.destination() == "s3":
+            return self.s3_prune(index_entries, entries)
+
+        remote_path = self.env.remote_path()
+        index = shlex.quote(self.index_path())
+        tmp_index = shlex.quote("{0}.tmp".format(self.index_path()))
+
+        command = ("rm -f {files} && {{ grep -v -x -F {lines} {index} > {tmp}; [ $? -le 1 ]; }} "
+                   "&& mv -f {tmp} {index}")
+        command = command.format(
+            files = " ".join(shlex.quote(os.path.join(remote_path, fname))
+                             for _, _, files in entries for fname in files),
+            lines = " ".join("-e {0}".format(shlex.quote("\t".join([stamp, key] + files)))
+                             for stamp, key, files in entries),
+            index = index,
+            tmp = tmp_index,
+        )
+
+        logging.info("%s - pruning %s expired artifacts.", self.handler_name, len(entries))
+        ok = self.execute(self.index_command(command), supervised=False)
+        if not ok:
+            logging.error("%s - failed pruning expired artifacts.", self.handler_name)
+        return ok
+
+    def s3_prune(self, entries, expired):
+        """
+        Deletes ``expired`` index entries of s3 destination with batched
+        delete requests and removes them from handler index object.
+        Objects are deleted first, so a failed index update only leaves
+        entries that are deleted again on next prune.
+        """
+        logging.info("%s - pruning %s expired artifacts.", self.handler_name, len(expired))
+        try:
+            self.s3().delete_objects(self.s3_key(fname) for _, _, files in expired for fname in files)
+            self.s3_write_index([entry for entry in entries if entry not in expired])
+        except S3Error as e:
+            logging.error("%s - failed pruning expired artifacts: %s", self.handler_name, e)
+            return False
+        return True
+
+    def scp_put_parallel(self, local_path, final_name, streams, bwlimit=None):
+        """
+        Put local file to backup host splitted on ``streams`` byte ranges,
+        each one uploaded with its own ssh connection to a part file. When
+        all parts are uploaded, they are concatenated on backup host, checksum
+        is verified and result is renamed to final name. ``bwlimit`` (by
+        default ``bwlimit`` option) is shared by all streams.
+        """
+        size = os.path.getsize(local_path)
+        streams = max(1, min(streams, size // self.stream_chunk_size))
+        part_size = -(-size // streams)
+        remote_path = os.path.join(self.env.remote_path(), final_name)
+        parts = ["{0}.part{1:03d}".format(remote_path, i) for i in range(streams)]
+        results = [False] * streams
+
+        # bandwidth limit is shared by all streams
+        bwlimit = bwlimit or self.bwlimit()
+        rate = bwlimit * 1024 / streams if bwlimit else None
+
+        def put_range(i):
+            command = self.ssh_command("cat > {0}".format(shlex.quote(parts[i])))
+            offset = i * part_size
+            remaining = max(0, min(part_size, size - offset))
+            start, sent = time.time(), 0
+
+            with tempfile.TemporaryFile() as stderr:
+                p = self.popen(command, stdin=PIPE, stdout=DEVNULL, stderr=stderr)
+                supervisor = self.supervise([p])
+                try:
+                    with open(local_path, "rb") as f:
+                        f.seek(offset)
+                        while remaining > 0:
+                            chunk = f.read(min(self.stream_chunk_size, remaining))
+                            if not chunk:
+                                break
+                            p.stdin.write(chunk)
+                            remaining -= len(chunk)
+
+                            sent += len(chunk)
+                            if rate is not None:
+                                delay = sent / rate - (time.time() - start)
+                                if delay > 0:
+                                    time.sleep(delay)
+                    p.stdin.close()
+                except (IOError, OSError):
+                    p.kill()
+                p.wait()
+
+                stderr.seek(0)
+                self.print_output((None, stderr.read()))
+
+            if supervisor is not None and not supervisor.finish():
+                return
+            results[i] = p.returncode == 0 and remaining == 0
+
+        checksum = hashlib.sha256()
+        def hash_file():
+            with open(local_path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.stream_chunk_size), b""):
+                    checksum.update(chunk)
+
+        logging.info("%s - uploading %s with %s streams.", self.handler_name, local_path, streams)
+        threads = [threading.Thread(target=put_range, args=(i,)) for i in range(streams)]
+        threads.append(threading.Thread(target=hash_file))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        quoted_parts = " ".join(shlex.quote(part) for part in parts)
+        if not all(results):
+            logging.error("%s - failed parallel upload of %s.", self.handler_name, local_path)
+            self.ssh("rm -f {0}".format(quoted_parts), supervised=False)
+            return False
+
+        tmp_path = shlex.quote("{0}.tmp".format(remote_path))
+        command = ("cat {parts} > {tmp} && rm -f {parts} && "
+                   "echo '{checksum}  '{tmp} | sha256sum -c --status && mv -f {tmp} {path} || "
+                   "{{ rm -f {tmp} {parts}; exit 1; }}")
+        command = command.format(
+            parts = quoted_parts,
+            tmp = tmp_path,
+            checksum = checksum.hexdigest(),
+            path = shlex.quote(remote_path),
+        )
+        return self.ssh(command)
+
+    def local_put(self, local_path, final_name):
+        """
+        Copy local file to local destination path with zero copy
+        primitives. File is copied with temporary name and renamed
+        to final name when copy is complete.
+        """
+        remote_path = self.env.remote_path()
+        if not os.path.exists(remote_path):
+            os.makedirs(remote_path)
+
+        tmp_path = os.path.join(remote_path, ".{0}.part".format(final_name))
+        logging.info("%s - copy: %s %s", self.handler_name, local_path,
+                     os.path.join(remote_path, final_name))
+
+        try:
+            copy_file(local_path, tmp_path)
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.rename(tmp_path, os.path.join(remote_path, final_name))
+        except (IOError, OSError) as e:
+            logging.error("%s - failed copy: %s", self.handler_name, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        return True
+
+    def scp_put_atomic(self, local_path, final_name):
+        """
+        Put local file to backup host with temporary name and
+        rename it to final name when upload is complete.
+        """
+        if self.env.destination() == "local":
+            return self.local_put(local_path, final_name)
+
+        if self.env.destination() == "s3":
+            # objects are created only when upload is complete
+            return self.s3_put(local_path, final_name)
+
+        tmp_name = "{0}.part".format(final_name)
+        if not self.scp_put(local_path, tmp_name):
+            return False
+
+        remote_path = self.env.remote_path()
+        return self.ssh("mv -f {0} {1}".format(
+            shlex.quote(os.path.join(remote_path, tmp_name)),
+            shlex.quote(os.path.join(remote_path, final_name))))
+
+    def s3(self):
+        """
+        Returns a S3 client configured with ``s3_*`` options. Keys
+        can also be set with AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
+        environment variables.
+        """
+        if self._s3 is None:
+            for option in ("s3_endpoint", "s3_bucket"):
+                if self.option(option) is None:
+                    raise InvalidConfiguration("{0} is mandatory for s3 destination.".format(option))
+
+            part_size = self.option("s3_part_size")
+            part_size = parse_size(part_size) if part_size else None
+            if part_size is not None and part_size < S3Client.min_part_size:
+                raise InvalidConfiguration("s3_part_size must be at least 5M.")
+
+            self._s3 = S3Client(
+                endpoint = self.option("s3_endpoint"),
+                bucket = self.option("s3_bucket"),
+                access_key = self.option("s3_access_key", os.environ.get("AWS_ACCESS_KEY_ID")),
+                secret_key = self.option("s3_secret_key", os.environ.get("AWS_SECRET_ACCESS_KEY")),
+                region = self.option("s3_region"),
+                part_size = part_size,
+                concurrency = self.option("s3_concurrency"),
+                retries = self.option("s3_retries"),
+            )
+        return self._s3
+
+    def s3_key(self, final_name):
+        """
+        Returns object key of an artifact, same as
+        its path on a backup host.
+        """
+        return os.path.join(self.env.remote_path(), final_name).lstrip("/")
+
+    def s3_put(self, local_path, final_name):
+        """
+        Put local file to s3 destination with a multipart upload.
+        """
+        key = self.s3_key(final_name)
+        logging.info("%s - upload: %s s3://%s/%s", self.handler_name, local_path,
+                     self.option("s3_bucket"), key)
+        try:
+            self.s3().upload_file(local_path, key)
+        except (S3Error, IOError, OSError) as e:
+            logging.error("%s - failed upload of %s: %s", self.handler_name, local_path, e)
+            return False
+        return True
+
+    def s3_put_stream(self, commands, final_name):
+        """
+        Runs commands pipeline and uploads its output to s3 destination
+        with a multipart upload, without a local copy. Object is created
+        only if pipeline is success.
+        """
+        procs = self.pipeline(commands)
+        results = []
+
+        def finished():
+            results.append(self.wait_pipeline(procs))
+            return results[0]
+
+        key = self.s3_key(final_name)
+        logging.info("%s - upload: stream s3://%s/%s", self.handler_name,
+                     self.option("s3_bucket"), key)
+        try:
+            self.s3().upload_stream(procs[-1].stdout, key, finished)
+            ok = True
+        except S3Error as e:
+            logging.error("%s - failed upload of %s: %s", self.handler_name, final_name, e)
+            ok = False
+
+        if not results:
+            # upload failed before the end of stream
+            for p in procs:
+                if p.poll() is None:
+                    p.kill()
+            self.wait_pipeline(procs)
+
+        return ok
+
+    def ssh_command(self, remote_command):
+        """
+        Returns a command that executes a shell
+        command on backup host.
+        """
+        if self.env.destination() == "local":
+            return "sh -c {0}".format(shlex.quote(remote_command))
+
+        return "{command} {host} {remote_command}".format(
+            command = self.env.command_ssh(),
             host = self.env.remote_host(),
+            remote_command = shlex.quote(remote_command),
+        )
+
+    def ssh_output(self, remote_command):
+        """
+        Execute a shell command on backup host and return tuple
+        when the first element is boolean and second the stdout.
+        """
+        command_str = self.ssh_command(remote_command)
+        logging.info("%s - exec: %s", self.handler_name, command_str)
+
+        with self.popen(command_str, stdout=PIPE, stderr=PIPE) as p:
+            supervisor = self.supervise([p])
+            out, err = p.communicate()
+            self.print_output((None, err))
+
+        if supervisor is not None and not supervisor.finish():
+            return False, ''
+        return p.returncode == 0, out.decode('utf-8')
+
+    def find_artifact(self, artifact_rx, stamp=None, legacy_rx=None):
+        """
+        Search on backup host the newest artifact (or the artifact with
+        ``stamp`` timestamp) that matches ``artifact_rx``. The regular
+        expression must have a ``stamp`` group and for splitted artifacts
+        must match only the manifest.
+
+        ``legacy_rx`` matches artifacts with old names, used for
+        timestamps without artifacts that match ``artifact_rx``.
+        """
+        def match(names):
+            artifacts, legacy = {}, {}
+            for fname in names:
+                match = artifact_rx.match(fname)
+                if match is not None:
+                    artifacts[match.group("stamp")] = fname
+                elif legacy_rx is not None:
+                    match = legacy_rx.match(fname)
+                    if match is not None:
+                        legacy[match.group("stamp")] = fname
+            legacy.update(artifacts)
+            return legacy
+
+        # artifacts index avoids listing of large directories
+        key = self.retention_key()
+        entries = self.read_index() or []
+        artifacts = match(fname for _, entry_key, files in entries if entry_key == key
+                          for fname in files)
+
+        if not artifacts and self.env.destination() == "s3":
+            try:
+                keys = self.s3().list_objects(self.s3_key(""))
+            except S3Error as e:
+                logging.error("%s - failed listing artifacts: %s", self.handler_name, e)
+                return None
+            artifacts = match(os.path.basename(key) for key in keys)
+
+        elif not artifacts:
+            ok, out = self.ssh_output("ls -1 {0}".format(shlex.quote(self.env.remote_path())))
+            if not ok:
+                return None
+            artifacts = match(out.splitlines())
+
+        if not artifacts:
+            return None
+
+        if stamp is None:
+            return artifacts[max(artifacts)]
+        return artifacts.get(stamp)
+
+    @contextmanager
+    def remote_stream(self, name):
+        """
+        Context manager that returns a file object with the
+        content of a file of backup host or s3 destination.
+        """
+        if self.env.destination() == "s3":
+            response = self.s3().get_object(self.s3_key(name))
+            try:
+                yield response
+            finally:
+                response.close()
+            return
+
+        command = self.ssh_command("cat {0}".format(
+            shlex.quote(os.path.join(self.env.remote_path(), name))))
+        logging.info("%s - exec: %s", self.handler_name, command)
+
+        with tempfile.TemporaryFile() as stderr:
+            p = self.popen(command, stdout=PIPE, stderr=stderr)
+            try:
+                yield p.stdout
+            finally:
+                p.stdout.close()
+                p.wait()
+                stderr.seek(0)
+                self.print_output((None, stderr.read()))
+
+        if p.returncode != 0:
+            raise IOError("failed reading {0}".format(name))
+
+    def artifact_files(self, artifact):
+        """
+        Returns a list of (name, checksum) tuples with the files of an
+        artifact. Splitted artifacts files are readed from manifest, with
+        their checksums, other artifacts have one file without checksum.
+        Returns None if manifest can not be readed.
+        """
+        if not artifact.endswith(".manifest"):
+            return [(artifact, None)]
+
+        ok, manifest = self.read_remote(artifact)
+        if not ok:
+            return None
+
+        files = [line.split(None, 1) for line in manifest.splitlines() if line.strip()]
+        return [(name.strip(), checksum) for checksum, name in files]
+
+    def stream_artifact(self, files, commands):
+        """
+        Streams artifact files in order to ``commands`` pipeline,
+        verifying their checksums (if any) while are streamed. On
+        checksum mismatch pipeline is killed.
+        """
+        procs = self.pipeline(commands, stdout=DEVNULL, stdin=PIPE)
+        errors = []
+        try:
+            for name, expected in files:
+                checksum = hashlib.sha256()
+                with self.remote_stream(name) as stream:
+                    for chunk in iter(lambda: stream.read(self.stream_chunk_size), b""):
+                        checksum.update(chunk)
+                        procs[0].stdin.write(chunk)
+                if expected is not None and checksum.hexdigest() != expected:
+                    errors.append("checksum mismatch of {0}".format(name))
+                    break
+        except (S3Error, IOError, OSError) as e:
+            errors.append(str(e))
+        finally:
+            try:
+                procs[0].stdin.close()
+            except (IOError, OSError):
+                pass
+
+        if errors:
+            logging.error("%s - failed streaming %s: %s", self.handler_name, files[0][0], errors[0])
+            for p in procs:
+                if p.poll() is None:
+                    p.kill()
+
+        return self.wait_pipeline(procs) and not errors
+
+    def decompress_command(self, artifact):
+        """
+        Returns a decompress command for artifact extension or
+        None if artifact is not compressed.
+        """
+        artifact = self.artifact_base(artifact)
+        if artifact.endswith(self.encryption_ext):
+            artifact = artifact[:-len(self.encryption_ext)]
+
+        _, ext = os.path.splitext(artifact)
+        return self.decompress_commands.get(ext)
+
+    def artifact_base(self, artifact):
+        """
+        Returns artifact name without manifest extension.
+        """
+        if artifact.endswith(".manifest"):
+            return artifact[:-len(".manifest")]
+        return artifact
+
+    def restore_commands(self, artifact):
+        """
+        Returns decrypt and decompress commands needed for read
+        artifact content, or None if artifact can not be decrypted.
+        """
+        commands = []
+        if self.artifact_base(artifact).endswith(self.encryption_ext):
+            if not self.check_decryption_keys(artifact):
+                return None
+            commands.append("{0} --batch --quiet --decrypt".format(self.env.command_gpg()))
+
+        decompress_command = self.decompress_command(artifact)
+        if decompress_command is not None:
+            commands.append(decompress_command)
+        return commands
+
+    def restore_artifact(self, artifact, commands):
+        """
+        Streams artifact from backup host through decryption and
+        decompression to ``commands`` pipeline, without a local copy.
+        Volumes of splitted artifacts are verified with manifest checksums
+        while are streamed.
+        """
+        restore_commands = self.restore_commands(artifact)
+        if restore_commands is None:
+            return False
+
+        if self.env.destination() != "s3" and not artifact.endswith(".manifest"):
+            # a single file is piped directly from backup host
+            stream_command = self.ssh_command("cat {0}".format(
+                shlex.quote(os.path.join(self.env.remote_path(), artifact))))
+            procs = self.pipeline([stream_command] + restore_commands + commands, stdout=DEVNULL)
+            return self.wait_pipeline(procs)
+
+        files = self.artifact_files(artifact)
+        if files is None:
+            logging.error("%s - failed reading manifest %s.", self.handler_name, artifact)
+            return False
+
+        return self.stream_artifact(files, restore_commands + commands)
+
+    def ssh(self, remote_command, supervised=True):
+        """
+        Execute a shell command on backup host.
+        """
+        command_str = self.ssh_command(remote_command)
+        logging.info("%s - exec: %s", self.handler_name, command_str)
+        return self.execute(command_str, supervised=supervised)
+
+    def remote_location(self, remote_path):
+        """
+        Returns rsync location of a path on backup host.
+        """
+        if self.env.destination() == "local":
+            return remote_path
+        return "{host}:{remote_path}".format(host=self.env.remote_host(),
+                                             remote_path=remote_path)
+
+    def bwlimit(self):
+        """
+        Returns transfers bandwidth limit in KB/s or None.
+        """
+        bwlimit = self.option("bwlimit")
+        if bwlimit is None:
+            return None
+        return int(bwlimit)
+
+    def rsync(self, path, remote_path=None, extra_args=""):
+        """
+        Synchronize local path with backup host. If ``remote_path``
+        is None, environment remote path is used as destination.
+        """
+        if remote_path is None:
             remote_path = self.env.remote_path()
+
+        if self.bwlimit():
+            extra_args = "--bwlimit={0} {1}".format(self.bwlimit(), extra_args)
+
+        command_str = "{command} {extra_args} {path} {remote_path}".format(
+            command = self.env.command_rsync(), 
+            extra_args = extra_args,
+            path = path,
+            remote_path = self.remote_location(remote_path),
+        )
+        logging.info("%s - exec: %s", self.handler_name, command_str)
+        return self.execute(command_str)
+
+    def rsync_pull(self, remote_path, path, extra_args=""):
+        """
+        Synchronize ``remote_path`` of backup host on local path.
+        """
+        if self.bwlimit():
+            extra_args = "--bwlimit={0} {1}".format(self.bwlimit(), extra_args)
+
+        command_str = "{command} {extra_args} {remote_path} {path}".format(
+            command = self.env.command_rsync(),
+            extra_args = extra_args,
+            remote_path = self.remote_location(remote_path),
+            path = path,
         )
         logging.info("%s - exec: %s", self.handler_name, command_str)
         return self.execute(command_str)
+
+    async def arun(self):
+        """
+        Asyncio counterpart of ``run``. By default ``run`` is executed
+        on a thread of event loop executor (and it can not be interrupted
+        on cancellation), handlers can reimplement it with asyncio methods.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.run)
+
+    async def arun_job(self):
+        """
+        Asyncio counterpart of ``run_job``. On cancellation local
+        temporary files are deleted.
+        """
+        timeout = self.option("timeout")
+        retries = int(self.option("retries", 0))
+        retry_delay = float(self.option("retry_delay", 60))
+
+        try:
+            for attempt in range(retries + 1):
+                if timeout is not None:
+                    self.deadline = time.time() + float(timeout)
+
+                try:
+                    ok = await self.arun()
+                except Exception:
+                    logging.exception("%s - error (%s).", self.handler_name, self.name)
+                    ok = False
+                finally:
+                    self.deadline = None
+
+                if ok:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.prune_job)
+                    return True
+
+                self.cleanup()
+                if attempt < retries:
+                    delay = retry_delay * 2 ** attempt
+                    logging.error("%s - failed (%s), retrying in %s seconds.",
+                                  self.handler_name, self.name, delay)
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            logging.error("%s - cancelled (%s).", self.handler_name, self.name)
+            self.cleanup()
+            raise
+
+        logging.error("%s - failed (%s).", self.handler_name, self.name)
+        return False
+
+    async def apopen(self, command, **kwargs):
+        """
+        Starts a command as asyncio subprocess with handler priority
+        settings. Commands are always started on a new session, so they
+        can be killed with all their children on cancellation.
+        """
+        kwargs["start_new_session"] = True
+        args, kwargs = self.process_args(command, kwargs)
+        return await asyncio.create_subprocess_exec(*args, **kwargs)
+
+    async def akill(self, procs):
+        """
+        Kills process groups of asyncio subprocesses
+        and waits for them.
+        """
+        for p in procs:
+            if p.returncode is None:
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        for p in procs:
+            await p.wait()
+
+    async def afinish(self, supervisor):
+        """
+        Stops a supervisor without blocking the event loop and
+        returns False if processes were terminated by it.
+        """
+        if supervisor is None:
+            return True
+
+        supervisor.stop()
+        while supervisor.is_alive():
+            await asyncio.sleep(0.05)
+        return supervisor.reason is None
+
+    async def aexecute(self, command, stdout=PIPE, stderr=PIPE, okreturncode=0, supervised=True):
+        """
+        Asyncio counterpart of ``execute``. On cancellation command
+        is killed with all its children.
+        """
+        p = await self.apopen(command, stdout=stdout, stderr=stderr)
+        supervisor = self.supervise([p]) if supervised else None
+
+        try:
+            output = await p.communicate()
+        except asyncio.CancelledError:
+            await self.akill([p])
+            await self.afinish(supervisor)
+            raise
+
+        self.print_output(output)
+        if not await self.afinish(supervisor):
+            return False
+
+        return p.returncode == okreturncode
+
+    async def apipeline(self, commands, stdout=PIPE):
+        """
+        Asyncio counterpart of ``pipeline``. Stages are chained with os
+        pipes, so data is not copied by the event loop and a slow stage
+        blocks previous stages when pipe buffer is full. With ``stdout=PIPE``
+        stdout of last process is a stream reader that stops reading from
+        the pipe when has ``stream_chunk_size`` bytes buffered.
+        """
+        procs, stdin = [], None
+        try:
+            for i, command in enumerate(commands):
+                logging.info("%s - exec: %s", self.handler_name, command)
+
+                last = i == len(commands) - 1
+                next_stdin, out = (None, stdout) if last else os.pipe()
+                stderr = tempfile.TemporaryFile()
+                try:
+                    p = await self.apopen(command, stdin=stdin, stdout=out, stderr=stderr,
+                                          limit=self.stream_chunk_size)
+                except BaseException:
+                    stderr.close()
+                    if next_stdin is not None:
+                        os.close(next_stdin)
+                    raise
+                finally:
+                    # only child processes needs the pipes
+                    if stdin is not None:
+                        os.close(stdin)
+                    if not last:
+                        os.close(out)
+
+                p.stderr_log = stderr
+                stdin = next_stdin
+                procs.append(p)
+        except BaseException:
+            await self.akill(procs)
+            for p in procs:
+                p.stderr_log.close()
+            raise
+
+        supervisor = self.supervise(procs)
+        for p in procs:
+            p.supervisor = supervisor
+
+        return procs
+
+    async def await_pipeline(self, procs, okreturncode=0):
+        """
+        Asyncio counterpart of ``wait_pipeline``. On cancellation all
+        pipeline processes are killed.
+        """
+        ok = True
+        try:
+            for p in procs:
+                await p.wait()
+                ok = ok and p.returncode == okreturncode
+        except asyncio.CancelledError:
+            await self.akill(procs)
+            await self.afinish(procs[0].supervisor)
+            raise
+        finally:
+            for p in procs:
+                p.stderr_log.seek(0)
+                self.print_output((None, p.stderr_log.read()))
+                p.stderr_log.close()
+
+        if not await self.afinish(procs[0].supervisor):
+            return False
+        return ok
+
+    async def assh(self, remote_command, supervised=True):
+        """
+        Asyncio counterpart of ``ssh``.
+        """
+        command_str = self.ssh_command(remote_command)
+        logging.info("%s - exec: %s", self.handler_name, command_str)
+        return await self.aexecute(command_str, supervised=supervised)
+
+    async def aremove_remote(self, names):
+        """
+        Asyncio counterpart of ``remove_remote``.
+        """
+        if not names:
+            return True
+
+        if self.env.destination() == "s3":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.remove_remote, names)
+
+        remote_path = self.env.remote_path()
+        return await self.assh("rm -f {0}".format(
+            " ".join(shlex.quote(os.path.join(remote_path, name)) for name in names)),
+            supervised=False)
+
+    async def aput_pipeline(self, commands, final_name):
+        """
+        Runs commands pipeline and streams its output directly to backup
+        host with a temporary name, without a local copy. Artifact is renamed
+        to final name when pipeline is success. ``bwlimit`` is not applied.
+        """
+        if self.env.destination() == "s3":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.s3_put_stream, commands, final_name)
+
+        if self.env.destination() == "local" and not os.path.exists(self.env.remote_path()):
+            os.makedirs(self.env.remote_path())
+
+        # concurrent uploads of same artifact must not share temporary file
+        tmp_name = "{0}.{1}.part".format(final_name, uuid.uuid4().hex[:8])
+        remote_path = self.env.remote_path()
+        upload_command = self.ssh_command("cat > {0}".format(
+            shlex.quote(os.path.join(remote_path, tmp_name))))
+
+        try:
+            procs = await self.apipeline(commands + [upload_command], stdout=DEVNULL)
+            ok = await self.await_pipeline(procs)
+            if ok:
+                ok = await self.assh("mv -f {0} {1}".format(
+                    shlex.quote(os.path.join(remote_path, tmp_name)),
+                    shlex.quote(os.path.join(remote_path, final_name))))
+        except asyncio.CancelledError:
+            await self.aremove_remote([tmp_name])
+            raise
+
+        if not ok:
+            await self.aremove_remote([tmp_name])
+        return ok
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 
+import io
 import os
+import re
+import json
+import shlex
+import asyncio
+import shutil
 import logging
+import tarfile
+import datetime
 import tempfile
 
+from subprocess import STDOUT, DEVNULL
+
 from .base import BaseHandler
 from ..exceptions import InvalidConfiguration
+from ..exceptions import S3Error
 from ..util import resolve_absolute_path
 
 class PostgreSQL(BaseHandler):
@@ -19,6 +30,8 @@ class PostgreSQL(BaseHandler):
     * `port`: set database port.
     * `compress`: set '1' if need compress pgdump output.
     * `pg_dump_command`: set a full path for a pg_dump command.
+    * `volume_size`: if set (like ``512M``), dump is streamed to backup host
+      on volumes of this size without a complete local copy.
 
     By default, pg_dump command is resolved with `which` system command.
         
@@ -29,6 +42,10 @@ class PostgreSQL(BaseHandler):
     pg_dump_command_template = ("{pg_dump_command} --host {host} --port {port} "
                                "-U {user} {dbname}")
 
+    psql_command = resolve_absolute_path('psql')
+    psql_command_template = ("{psql_command} --host {host} --port {port} "
+                             "-U {user} --quiet -v ON_ERROR_STOP=1 -d {dbname}")
+
     default_port = 5432
     default_host = '/tmp' # used for unix socket trusted connections.
 
@@ -67,17 +84,67 @@ class PostgreSQL(BaseHandler):
         Runs pg_dump and return tuple when the first element is boolen and second
         the filename.
         """
-        command = self.pg_dump_command_template.format(**self.config)
-        logging.info("%s - exec: %s", self.handler_name, command)
+        commands, suffix = [self.pg_dump_command_template.format(**self.config)], ""
+        if not self.config["compress"]:
+            # compressed dumps are encrypted by compress
+            commands, suffix = self.encrypted(commands, suffix)
 
-        with tempfile.NamedTemporaryFile(suffix=".sql", delete=False) as f:
-            ok =  self.execute(command, stdout=f)
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
             fname = f.name
 
+        ok = self.run_to_file(commands, fname)
         return ok, fname
 
+    def run_volumes(self):
+        """
+        Streams pg_dump output, compressed if is needed,
+        to backup host splitted on volumes.
+        """
+        commands = [self.pg_dump_command_template.format(**self.config)]
+        if self.config["compress"]:
+            commands.append(self.env.command_compress())
+
+        final_name = self.artifact_name("postgresql.sql{0}".format(
+            ".xz" if self.config["compress"] else ""))
+
+        commands, final_name = self.encrypted(commands, final_name)
+        ok = self.put_volumes(commands, final_name)
+        if not ok:
+            logging.error("%s - failed pg_dump volumes.", self.handler_name)
+        return ok
+
+    async def arun(self):
+        """
+        Streams pg_dump output, compressed if is needed, directly to
+        backup host without a local copy. Volumes are executed with
+        ``run`` on a thread.
+        """
+        if self.volume_size():
+            return await super(PostgreSQL, self).arun()
+
+        logging.info("%s - starting postgresql handler (%s).", self.handler_name, self.name)
+
+        commands = [self.pg_dump_command_template.format(**self.config)]
+        if self.config["compress"]:
+            commands.append(self.env.command_compress())
+
+        final_name = self.artifact_name("postgresql.sql{0}".format(
+            ".xz" if self.config["compress"] else ""))
+
+        commands, final_name = self.encrypted(commands, final_name)
+        ok = await self.aput_pipeline(commands, final_name)
+        if not ok:
+            logging.error("%s - pg_dump failed.", self.handler_name)
+        else:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.record_artifact, final_name)
+        return ok
+
     def run(self):
         logging.info("%s - starting postgresql handler (%s).", self.handler_name, self.name)
+
+        if self.volume_size():
+            return self.run_volumes()
         
         ok, file_path = self.dump_db()
         self.sched_for_delete(file_path)
@@ -96,23 +163,44 @@ class PostgreSQL(BaseHandler):
                 logging.error("%s - compress failed.", self.handler_name)
                 return
 
-        _, ext = os.path.splitext(file_path)
-        
-        final_name = "{name}.{stamp}.postgresql.sql{ext}".format(
-            name = self.env.name(),
-            ext = ext,
-            stamp = self.timestamp(),
-        )
+        # dump file has no extension, only compression and encryption ones
+        final_name = self.artifact_name("postgresql.sql{0}".format(self.artifact_ext(file_path)))
 
         ok = self.scp_put(file_path, final_name)
         if not ok:
             logging.error("%s - failed scp.", self.handler_name)
+        else:
+            self.record_artifact(final_name)
 
         return ok
 
+    def restore(self, stamp=None, target=None):
+        """
+        Streams dump from backup host to psql. If ``target`` is
+        set, it is used as database name instead of ``dbname``.
+        """
+        suffix = r"postgresql\.sql(\.xz)?(\.gpg)?(\.manifest)?"
+        artifact = self.find_artifact(self.artifact_rx(suffix), stamp,
+                                      self.artifact_rx(suffix, legacy=True))
+        if artifact is None:
+            logging.error("%s - no artifact found.", self.handler_name)
+            return False
+
+        config = dict(self.config)
+        if target is not None:
+            config['dbname'] = target
+        if "psql_command" not in config:
+            config['psql_command'] = self.psql_command()
+
+        logging.info("%s - restoring %s.", self.handler_name, artifact)
+        return self.restore_artifact(artifact, [self.psql_command_template.format(**config)])
+
 class MySQL(BaseHandler):
     """
     This is a handler for MySQL backups.
+
+    With `volume_size` parameter, `sql` type dumps are streamed to
+    backup host on volumes of this size.
     """
 
     prefix = "mysql"
@@ -121,6 +209,10 @@ class MySQL(BaseHandler):
     mysqldump_command_template = ("{mysqldump_command} --host={host} --port={port} "
                                   "--user={user} --password={password} {dbname}")
     
+    mysql_command = resolve_absolute_path('mysql')
+    mysql_command_template = ("{mysql_command} --host={host} --port={port} "
+                              "--user={user} --password={password} {dbname}")
+
     hotcopy_command = resolve_absolute_path('mysqlhotcopy')
     hotcopy_command_template = ("{hotcopy_command} --host={host} --port={port} "
                                 "--user={user} {dbname} {_tmp_dir}")
@@ -196,31 +288,53 @@ class MySQL(BaseHandler):
         Runs mysqldump and return tuple when the first element is boolen and second
         the filename.
         """
-        command = self.mysqldump_command_template.format(**self.config)
-        logging.info("%s - exec: %s", self.handler_name, command)
+        commands, suffix = [self.mysqldump_command_template.format(**self.config)], ""
+        if self.config["compress"] != "1":
+            # compressed dumps are encrypted by compress
+            commands, suffix = self.encrypted(commands, suffix)
 
-        with tempfile.NamedTemporaryFile(suffix=".sql", delete=False) as f:
-            ok =  self.execute(command, stdout=f)
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
             fname = f.name
 
+        ok = self.run_to_file(commands, fname)
         return ok, fname
 
+    def run_volumes(self):
+        """
+        Streams mysqldump output, compressed if is needed,
+        to backup host splitted on volumes.
+        """
+        commands = [self.mysqldump_command_template.format(**self.config)]
+        if self.config["compress"] == "1":
+            commands.append(self.env.command_compress())
+
+        final_name = self.artifact_name("mysql.mysqldump{0}".format(
+            ".xz" if self.config["compress"] == "1" else ""))
+
+        commands, final_name = self.encrypted(commands, final_name)
+        ok = self.put_volumes(commands, final_name)
+        if not ok:
+            logging.error("%s - failed mysqldump volumes.", self.handler_name)
+        return ok
+
     def run(self):
         logging.info("%s - starting MySQL handler (%s).", self.handler_name, self.name)
+
+        if self.config['type'] == 'sql' and self.volume_size():
+            return self.run_volumes()
         
         if self.config['type'] == 'sql':
             backup_command = 'mysqldump'
             ok, file_path = self.sql_backup()
-            name_append = 'mysqldump'
             self.sched_for_delete(file_path)
         elif self.config['type'] == 'binary':
             backup_command = 'mysqlhotcopy'
             ok, dir_path = self.binary_backup()
             self.sched_for_delete(dir_path)
             if ok:
-                ok, file_path = self.tar(dir_path, dir_path)
-                self.sched_for_delete(file_path)
-                name_append = 'mysqlhotcopy.tar'
+                # compressed tarballs are encrypted by compress
+                ok, file_path = self.tar(dir_path, ".", "mysqlhotcopy",
+                                         encrypt=self.config["compress"] != "1")
         else:
             ok = False
 
@@ -238,17 +352,547 @@ class MySQL(BaseHandler):
                 logging.error("%s - compress failed.", self.handler_name)
                 return
 
-        _, ext = os.path.splitext(file_path)
-        
-        final_name = "{name}.{stamp}.mysql.{name_append}{ext}".format(
-            name = self.env.name(),
-            ext = ext,
-            stamp = self.timestamp(),
-            name_append = name_append
-        )
+        if self.config['type'] == 'sql':
+            # dump file has no extension, only compression and encryption ones
+            final_name = self.artifact_name("mysql.mysqldump{0}".format(
+                self.artifact_ext(file_path)))
+        else:
+            final_name = self.artifact_name("mysql.{0}".format(os.path.basename(file_path)))
 
         ok = self.scp_put(file_path, final_name)
         if not ok:
             logging.error("%s - failed scp.", self.handler_name)
+        else:
+            self.record_artifact(final_name)
+
+        return ok
+
+    def restore(self, stamp=None, target=None):
+        """
+        Streams `sql` type dump from backup host to mysql. If ``target``
+        is set, it is used as database name instead of ``dbname``.
+
+        `binary` type backups are extracted on ``target`` directory,
+        they must be copied to mysql data directory by hand.
+        """
+        if self.config['type'] == 'binary':
+            return self.restore_binary(stamp, target)
+
+        artifact = self.find_artifact(
+            self.artifact_rx(r"mysql\.mysqldump(\.xz)?(\.gpg)?(\.manifest)?"), stamp,
+            self.artifact_rx(r"mysql\.mysqldump(\.sql|\.xz)?(\.gpg)?(\.manifest)?", legacy=True))
+        if artifact is None:
+            logging.error("%s - no artifact found.", self.handler_name)
+            return False
+
+        config = dict(self.config)
+        if target is not None:
+            config['dbname'] = target
+        if "mysql_command" not in config:
+            config['mysql_command'] = self.mysql_command()
+
+        logging.info("%s - restoring %s.", self.handler_name, artifact)
+        return self.restore_artifact(artifact, [self.mysql_command_template.format(**config)])
+
+    def restore_binary(self, stamp=None, target=None):
+        """
+        Streams mysqlhotcopy tarball from backup host and
+        extracts it on ``target`` directory.
+        """
+        if target is None:
+            logging.error("%s - restore of binary backups needs a target directory.",
+                          self.handler_name)
+            return False
+
+        suffix = r"mysql\.mysqlhotcopy\.tar(\.xz)?(\.gpg)?"
+        artifact = self.find_artifact(self.artifact_rx(suffix), stamp,
+                                      self.artifact_rx(suffix, legacy=True))
+        if artifact is None:
+            logging.error("%s - no artifact found.", self.handler_name)
+            return False
+
+        if not os.path.exists(target):
+            os.makedirs(target)
+
+        command = "{command} -x -f - -C {target}".format(
+            command = self.env.command_tar(),
+            target = shlex.quote(target),
+        )
+
+        logging.info("%s - restoring %s.", self.handler_name, artifact)
+        return self.restore_artifact(artifact, [command])
+
+
+class PostgreSQLWAL(BaseHandler):
+    """
+    This is a handler for postgresql continuous archiving: periodic base
+    backups with pg_basebackup plus WAL streaming with pg_receivewal.
+
+    This accepts this parameters:
+
+    * `host`: set database host.
+    * `port`: set database port.
+    * `user`: set replication user.
+    * `wal_dir`: local spool directory where pg_receivewal writes segments.
+    * `slot`: replication slot name used by pg_receivewal.
+    * `base_backup_interval`: days between base backups (default: 7).
+    * `keep_base_backups`: number of newest base backups kept on backup host,
+      older ones and the WAL segments that only they need are deleted.
+    * `compress`: set '1' if need compress base backups and segments.
+    * `pg_receivewal_command`: set a full path for a pg_receivewal command.
+    * `pg_basebackup_command`: set a full path for a pg_basebackup command.
+
+    On each execution this handler starts pg_receivewal if is not running,
+    takes a base backup if last one is older than `base_backup_interval`
+    and ships all completed segments to backup host. Schedule it every few
+    minutes for a minute-level recovery point.
+
+    A json catalog is uploaded with the list of base backups and the
+    first and last WAL segment available for each one.
+
+    With environment encryption, base backups and segments are encrypted
+    and a ``.keys.json`` file is uploaded for each base backup file and
+    for the WAL archive.
+    """
+
+    prefix = "postgresql-wal"
+
+    pg_receivewal_command = resolve_absolute_path('pg_receivewal')
+    pg_receivewal_command_template = ("{pg_receivewal_command} --host {host} --port {port} "
+                                      "-U {user} --slot {slot} --directory {wal_dir} --no-password")
+    pg_receivewal_slot_command_template = ("{pg_receivewal_command} --host {host} --port {port} "
+                                           "-U {user} --slot {slot} --create-slot --if-not-exists "
+                                           "--no-password")
+
+    pg_basebackup_command = resolve_absolute_path('pg_basebackup')
+    pg_basebackup_command_template = ("{pg_basebackup_command} --host {host} --port {port} "
+                                      "-U {user} -D {_tmp_dir} -Ft -X none --checkpoint=fast "
+                                      "--no-password")
+
+    default_port = 5432
+    default_host = '/tmp'
+    default_slot = 'bytehold'
+    default_base_backup_interval = 7
+
+    pidfile_name = 'pg_receivewal.pid'
+    logfile_name = 'pg_receivewal.log'
+    catalog_name = 'catalog.json'
+
+    segment_rx = re.compile(r'^[0-9A-F]{24}$')
+    history_rx = re.compile(r'^[0-9A-F]{8}\.history$')
+    start_wal_rx = re.compile(r'^START WAL LOCATION: .* \(file ([0-9A-F]{24})\)$', re.M)
+
+    def validate_config(self):
+        if "port" not in self.config:
+            self.config['port'] = self.default_port
+
+        if "host" not in self.config:
+            self.config['host'] = self.default_host
+
+        if "user" not in self.config:
+            self.config['user'] = os.getlogin()
+
+        if "slot" not in self.config:
+            self.config['slot'] = self.default_slot
+
+        if "wal_dir" not in self.config:
+            raise InvalidConfiguration("wal_dir parameter is mandatory.")
+
+        if "base_backup_interval" not in self.config:
+            self.config['base_backup_interval'] = self.default_base_backup_interval
+        else:
+            self.config['base_backup_interval'] = int(self.config['base_backup_interval'])
+
+        if "compress" not in self.config:
+            self.config["compress"] = True
+        else:
+            conf_compress = self.config['compress']
+            if isinstance(conf_compress, bool):
+                pass
+            elif conf_compress.strip() in  ('1', 'true'):
+                self.config['compress'] = True
+            else:
+                self.config['compress'] = False
+
+        for command_name in ("pg_receivewal_command", "pg_basebackup_command"):
+            if command_name not in self.config:
+                command = getattr(self, command_name)
+                if callable(command):
+                    self.config[command_name] = command()
+                else:
+                    self.config[command_name] = command
+
+    def wal_path(self, *parts):
+        return os.path.join(self.config['wal_dir'], *parts)
+
+    def load_catalog(self):
+        """
+        Returns local catalog or an empty one on first execution.
+        """
+        path = self.wal_path(self.catalog_name)
+        if not os.path.exists(path):
+            return {"base_backups": [], "wal_first": None, "wal_last": None, "history": []}
+
+        with io.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_catalog(self, catalog):
+        """
+        Atomically write local catalog and upload it to backup host.
+        """
+        path = self.wal_path(self.catalog_name)
+        tmp_path = "{0}.tmp".format(path)
+        with io.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(catalog, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
+
+        return self.scp_put_atomic(path, "{0}.catalog.json".format(self.wal_prefix()))
+
+    def wal_prefix(self):
+        """
+        Returns name prefix of WAL archive files of this handler:
+        ``{env}.postgresql-wal.{handler}``.
+        """
+        return "{name}.postgresql-wal.{handler}".format(
+            name = self.env.name(),
+            handler = self.artifact_handler_name(),
+        )
+
+    def receiver_pid(self):
+        """
+        Returns pid of running pg_receivewal or None. Pid file may be
+        stale after a reboot, so the process must be a pg_receivewal
+        (checked with /proc when is available).
+        """
+        try:
+            with open(self.wal_path(self.pidfile_name)) as f:
+                pid = int(f.read().strip())
+            os.kill(pid, 0)
+
+            cmdline_path = "/proc/{0}/cmdline".format(pid)
+            if os.path.isdir("/proc/self"):
+                with open(cmdline_path, "rb") as f:
+                    if b"pg_receivewal" not in f.read():
+                        return None
+        except (IOError, OSError, ValueError):
+            return None
+        return pid
+
+    def start_receiver(self):
+        """
+        Creates replication slot if not exists and starts pg_receivewal
+        detached from current process.
+        """
+        command = self.pg_receivewal_slot_command_template.format(**self.config)
+        logging.info("%s - exec: %s", self.handler_name, command)
+        if not self.execute(command):
+            return False
+
+        command = self.pg_receivewal_command_template.format(**self.config)
+        logging.info("%s - exec: %s", self.handler_name, command)
+
+        with open(self.wal_path(self.logfile_name), "ab") as log:
+            p = self.popen(command, supervised=False, stdout=log, stderr=STDOUT,
+                           stdin=DEVNULL, start_new_session=True)
+
+        with open(self.wal_path(self.pidfile_name), "w") as f:
+            f.write(str(p.pid))
+
+        return True
+
+    def start_wal_segment(self, tar_path):
+        """
+        Returns the first WAL segment needed by base backup, readed
+        from backup_label file stored on base tarball.
+        """
+        with tarfile.open(tar_path) as tar:
+            label = tar.extractfile("backup_label").read().decode("utf-8")
+
+        match = self.start_wal_rx.search(label)
+        if match is None:
+            return None
+        return match.group(1)
+
+    def base_backup_due(self, catalog):
+        if not catalog["base_backups"]:
+            return True
+
+        last = datetime.datetime.strptime(catalog["base_backups"][-1]["stamp"], "%Y-%m-%d_%H%M")
+        interval = datetime.timedelta(days=self.config["base_backup_interval"])
+        return datetime.datetime.now() - last >= interval
+
+    def base_backup(self, catalog):
+        """
+        Runs pg_basebackup and uploads all resultant files.
+        """
+        dname = tempfile.mkdtemp()
+        self.sched_for_delete(dname)
+
+        command = self.pg_basebackup_command_template.format(_tmp_dir=dname, **self.config)
+        logging.info("%s - exec: %s", self.handler_name, command)
+        if not self.execute(command):
+            logging.error("%s - pg_basebackup failed.", self.handler_name)
+            return False
+
+        stamp = self.timestamp()
+        start_wal = self.start_wal_segment(os.path.join(dname, "base.tar"))
+        files = []
+
+        for fname in sorted(os.listdir(dname)):
+            file_path = os.path.join(dname, fname)
+
+            ext = self.wal_ext()
+            if ext:
+                compressed_path = file_path + ext
+                if not self.compress_file(file_path, compressed_path):
+                    logging.error("%s - compress failed.", self.handler_name)
+                    return False
+                os.remove(file_path)
+                file_path = compressed_path
+
+            final_name = "{name}.{stamp}.{handler}.postgresql-base.{fname}{ext}".format(
+                name = self.env.name(),
+                stamp = stamp,
+                handler = self.artifact_handler_name(),
+                fname = fname,
+                ext = ext,
+            )
+
+            if not self.scp_put_atomic(file_path, final_name):
+                logging.error("%s - failed scp.", self.handler_name)
+                return False
+            files.append(final_name)
+
+            if final_name.endswith(self.encryption_ext):
+                if not self.put_encryption_keys(final_name):
+                    logging.error("%s - failed uploading encryption keys of %s.",
+                                  self.handler_name, final_name)
+                    return False
+                files.append(final_name + self.keys_suffix)
+
+        catalog["base_backups"].append({
+            "stamp": stamp,
+            "files": files,
+            "wal_start": start_wal,
+            "wal_end": None,
+        })
+        return True
+
+    def completed_segments(self):
+        """
+        Returns a sorted list of completed WAL segments and
+        timeline history files on spool directory.
+        """
+        segments, history = [], []
+        for fname in os.listdir(self.config['wal_dir']):
+            if self.segment_rx.match(fname):
+                segments.append(fname)
+            elif self.history_rx.match(fname):
+                history.append(fname)
+        return sorted(segments), sorted(history)
+
+    def wal_ext(self):
+        """
+        Returns extension of uploaded base backup files and segments,
+        empty if they are uploaded as is.
+        """
+        ext = ".xz" if self.config["compress"] else ""
+        if self.encryption_command() is not None:
+            ext += self.encryption_ext
+        return ext
+
+    def compress_file(self, path, compressed_path):
+        """
+        Compress ``path`` to ``compressed_path`` and return True if is
+        success. If encryption is enabled, compressor output is encrypted
+        while is written. Source file is not removed.
+        """
+        if self.config["compress"]:
+            command = "{command} -c {path}".format(
+                command = self.env.command_compress(),
+                path = shlex.quote(path),
+            )
+        else:
+            command = "cat {0}".format(shlex.quote(path))
+
+        commands, _ = self.encrypted([command], compressed_path)
+        return self.run_to_file(commands, compressed_path)
+
+    def ship_wal(self, path, fname):
+        """
+        Uploads a WAL segment or history file. Spool file is never
+        modified, it is compressed to a temporary directory that is
+        removed after upload.
+        """
+        final_name = "{prefix}.{fname}{ext}".format(
+            prefix = self.wal_prefix(),
+            fname = fname,
+            ext = self.wal_ext(),
+        )
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            if self.wal_ext():
+                compressed_path = os.path.join(tmpdir, final_name)
+                if not self.compress_file(path, compressed_path):
+                    logging.error("%s - compress failed.", self.handler_name)
+                    return False
+                path = compressed_path
+
+            ok = self.scp_put_atomic(path, final_name)
+            if not ok:
+                logging.error("%s - failed scp.", self.handler_name)
+            return ok
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def put_wal_keys(self):
+        """
+        Uploads encryption keys file of WAL archive, shared by all
+        segments and history files.
+        """
+        name = self.wal_prefix()
+        ok = self.put_encryption_keys(name)
+        if not ok:
+            logging.error("%s - failed uploading encryption keys of %s.", self.handler_name, name)
+        return ok
+
+    def ship_segments(self, catalog):
+        """
+        Compress and upload all completed segments not yet shipped. Shipped
+        segments are removed from spool directory, only after their upload
+        is success, except the newest, that pg_receivewal uses for resume
+        streaming position. History files always stay on spool directory.
+        """
+        segments, history = self.completed_segments()
+        newest = segments[-1] if segments else None
+
+        if self.encryption_command() is not None and not self.put_wal_keys():
+            return False
+
+        for fname in history:
+            if fname in catalog["history"]:
+                continue
+
+            if not self.ship_wal(self.wal_path(fname), fname):
+                return False
+            catalog["history"].append(fname)
+
+        for fname in segments:
+            path = self.wal_path(fname)
+            if catalog["wal_last"] is not None and fname <= catalog["wal_last"]:
+                if fname != newest:
+                    os.remove(path)
+                continue
+
+            if not self.ship_wal(path, fname):
+                return False
+
+            if fname != newest:
+                os.remove(path)
+
+            if catalog["wal_first"] is None:
+                catalog["wal_first"] = fname
+            catalog["wal_last"] = fname
+
+            for base_backup in catalog["base_backups"]:
+                base_backup["wal_end"] = fname
+
+        return True
+
+    def prune(self):
+        """
+        Deletes base backups older than newest ``keep_base_backups`` ones
+        and WAL segments before the first segment needed by oldest kept
+        base backup, with one remote command. Expired base backups are
+        taken from the catalog and segments are matched by name prefix
+        of this handler, so backup host directory is not listed.
+        """
+        keep = self.option("keep_base_backups")
+        if not keep:
+            return True
+
+        catalog = self.load_catalog()
+        keep = int(keep)
+        if len(catalog["base_backups"]) <= keep:
+            return True
+
+        expired = catalog["base_backups"][:-keep]
+        wal_start = catalog["base_backups"][-keep]["wal_start"]
+        if wal_start is None:
+            logging.error("%s - unknown first segment of base backup %s, not pruning.",
+                          self.handler_name, catalog["base_backups"][-keep]["stamp"])
+            return False
+        files = [fname for base_backup in expired for fname in base_backup["files"]]
+
+        logging.info("%s - pruning %s expired base backups and segments before %s.",
+                     self.handler_name, len(expired), wal_start)
+
+        if self.env.destination() == "s3":
+            ok = self.s3_prune_wal(files, wal_start)
+        else:
+            command = ("cd {remote_path} && rm -f {files} && prefix={prefix} && "
+                       "for f in \"$prefix\".*; do seg=${{f#\"$prefix\".}}; seg=${{seg%%.*}}; "
+                       "if [ ${{#seg}} -eq 24 ] && [ \"$seg\" \\< {wal_start} ]; then "
+                       "rm -f \"$f\" || exit 1; fi; done")
+            ok = self.ssh(command.format(
+                remote_path = shlex.quote(self.env.remote_path()),
+                files = " ".join(shlex.quote(fname) for fname in files),
+                prefix = shlex.quote(self.wal_prefix()),
+                wal_start = shlex.quote(wal_start),
+            ), supervised=False)
+
+        if not ok:
+            logging.error("%s - failed pruning expired base backups.", self.handler_name)
+            return False
+
+        catalog["base_backups"] = catalog["base_backups"][-keep:]
+        if catalog["wal_first"] is not None and catalog["wal_first"] < wal_start:
+            catalog["wal_first"] = wal_start
+        return self.save_catalog(catalog)
+
+    def s3_prune_wal(self, files, wal_start):
+        """
+        Deletes expired base backup files and segments of s3 destination
+        with batched delete requests. Only WAL archive of this handler
+        is listed.
+        """
+        prefix = "{0}.".format(self.wal_prefix())
+        try:
+            keys = [self.s3_key(fname) for fname in files]
+            for key in self.s3().list_objects(self.s3_key(prefix)):
+                segment = os.path.basename(key)[len(prefix):].split(".")[0]
+                if self.segment_rx.match(segment) and segment < wal_start:
+                    keys.append(key)
+            self.s3().delete_objects(keys)
+        except S3Error as e:
+            logging.error("%s - failed pruning: %s", self.handler_name, e)
+            return False
+        return True
+
+    def run(self):
+        logging.info("%s - starting postgresql wal handler (%s).", self.handler_name, self.name)
+
+        if not os.path.exists(self.config['wal_dir']):
+            os.makedirs(self.config['wal_dir'])
+
+        if self.receiver_pid() is None:
+            logging.info("%s - starting pg_receivewal.", self.handler_name)
+            if not self.start_receiver():
+                logging.error("%s - pg_receivewal failed.", self.handler_name)
+                return False
+
+        catalog = self.load_catalog()
+
+        ok = True
+        if self.base_backup_due(catalog):
+            logging.info("%s - taking base backup.", self.handler_name)
+            ok = self.base_backup(catalog)
+
+        ok = self.ship_segments(catalog) and ok
+
+        if not self.save_catalog(catalog):
+            logging.error("%s - failed catalog upload.", self.handler_name)
+            return False
 
         return ok
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
+import re
+import os
+import shlex
 import logging
 import tempfile
-import os
 
 from .base import BaseHandler
 from ..exceptions import InvalidConfiguration
@@ -10,9 +12,37 @@ from ..exceptions import InvalidConfiguration
 class FileSystem(BaseHandler):
     """
     Handler for filesystem backup with rsync.
+
+    This accepts this parameters:
+
+    * `paths`: list or comma separated string of paths to synchronize.
+    * `snapshots`: number of versioned snapshots to keep on backup host.
+      If not set, all paths are synchronized on environment remote path.
+    * `snapshot_dir`: directory name, relative to environment remote path,
+      that stores snapshots. By default is derived from handler name.
+
+    In snapshot mode each execution synchronizes on a new timestamped
+    directory using ``--link-dest`` against previous snapshot, so unchanged
+    files are hardlinked and not transferred. A ``latest`` symlink points to
+    last complete snapshot.
     """
 
     prefix = "filesystem"
+    latest_name = "latest"
+    partial_name = ".{stamp}.partial"
+
+    def validate_config(self):
+        if "snapshots" in self.config:
+            try:
+                self.config['snapshots'] = int(self.config['snapshots'])
+            except ValueError:
+                raise InvalidConfiguration("snapshots parameter must be a number.")
+
+            if self.config['snapshots'] < 1:
+                raise InvalidConfiguration("snapshots parameter must be greater than 0.")
+
+            if "snapshot_dir" not in self.config:
+                self.config['snapshot_dir'] = re.sub(r'[^\w.-]+', '_', self.name)
 
     def run(self):
         logging.info("%s - starting filesystem backup handler (%s).", self.handler_name, self.name)
@@ -20,17 +50,112 @@ class FileSystem(BaseHandler):
         if "paths" not in self.config:
             raise InvalidConfiguration()
 
+        if self.env.destination() == "s3":
+            logging.error("%s - rsync backups are not supported on s3 destination.",
+                          self.handler_name)
+            return False
+
         paths = self.config['paths']
 
         if isinstance(paths, str):
             paths = paths.split(",")
 
+        if "snapshots" in self.config:
+            return self.run_snapshot(paths)
+
+        ok = True
+        for path in paths:
+            ok = self.rsync(path) and ok
+
+        return ok
+
+    def run_snapshot(self, paths):
+        """
+        Synchronize all paths on a new snapshot directory and
+        rotate old snapshots.
+        """
+        snapshots_path = os.path.join(self.env.remote_path(), self.config['snapshot_dir'])
+        stamp = self.timestamp()
+        latest_path = os.path.join(snapshots_path, self.latest_name)
+
+        # Snapshot is synchronized on a hidden partial directory, that is not
+        # matched by rotation, and renamed to its timestamp when is complete.
+        # Partial directories of killed executions are removed here.
+        partial_name = self.partial_name.format(stamp=stamp)
+        snapshot_path = os.path.join(snapshots_path, partial_name)
+
+        ok = self.ssh("mkdir -p {path} && cd {path} && rm -rf {partials} && mkdir {partial}".format(
+            path = shlex.quote(snapshots_path),
+            partials = self.partial_name.format(stamp="*"),
+            partial = partial_name,
+        ))
+        if not ok:
+            logging.error("%s - failed creating snapshot directory.", self.handler_name)
+            return False
+
+        # On first execution latest does not exists and rsync
+        # only shows a warning and makes a full copy.
+        link_dest = "--link-dest={0}".format(shlex.quote(latest_path))
         for path in paths:
-            self.rsync(path)
+            if not self.rsync(path, snapshot_path, link_dest):
+                logging.error("%s - failed rsync of %s, snapshot %s discarded.",
+                              self.handler_name, path, stamp)
+                self.ssh("rm -rf {0}".format(shlex.quote(snapshot_path)), supervised=False)
+                return False
+
+        # Rename of complete snapshot, atomic replace of latest symlink
+        # (rename over existing link) and prune of old snapshots in one
+        # remote command.
+        rotate_command = ("cd {path} && mv -T {partial} {stamp} && ln -sfn {stamp} {latest}.tmp && "
+                          "mv -fT {latest}.tmp {latest} && "
+                          "ls -1dr [0-9]*_[0-9]* | tail -n +{first} | xargs -r rm -rf --")
+        rotate_command = rotate_command.format(
+            path = shlex.quote(snapshots_path),
+            partial = partial_name,
+            stamp = stamp,
+            latest = self.latest_name,
+            first = self.config['snapshots'] + 1,
+        )
+
+        ok = self.ssh(rotate_command)
+        if not ok:
+            logging.error("%s - failed snapshot rotation.", self.handler_name)
+            self.ssh("rm -rf {0}".format(shlex.quote(snapshot_path)), supervised=False)
+
+        return ok
+
+    def restore(self, stamp=None, target=None):
+        """
+        Synchronize backup of all paths on ``target`` directory. In
+        snapshot mode, restores latest snapshot or snapshot ``stamp``.
+        """
+        if target is None:
+            logging.error("%s - restore needs a target directory.", self.handler_name)
+            return False
+
+        if "snapshots" in self.config:
+            snapshot_path = os.path.join(self.env.remote_path(), self.config['snapshot_dir'],
+                                         stamp or self.latest_name)
+            return self.rsync_pull(snapshot_path + "/", target)
+
+        paths = self.config['paths']
+        if isinstance(paths, str):
+            paths = paths.split(",")
+
+        ok = True
+        for path in paths:
+            remote_path = os.path.join(self.env.remote_path(),
+                                       os.path.basename(path.rstrip("/")))
+            ok = self.rsync_pull(remote_path, target) and ok
+
+        return ok
 
 class Tarball(BaseHandler):
     """
     Handler for tarball backup
+
+    With `volume_size` parameter (like ``512M``) tarball is streamed
+    and uploaded on volumes of that size while is created.
     """
 
     prefix = "tarball"
@@ -52,12 +177,20 @@ class Tarball(BaseHandler):
         base_path = self.config['base_path']
         compress_format = self.config['compress_format']
 
-        final_name = "{name}.{stamp}.tarball".format(
-            name = self.env.name(),
-            stamp = self.timestamp(),
-        )
+        final_name = self.artifact_name("tarball")
+
+        if self.volume_size():
+            _, ext = self.tar_flags(compress_format)
+            command = self.tar_command(base_path, paths, "-", compress_format)
+            final_name = "{0}.{1}".format(final_name, ext)
 
-        ok, path  = self.tar(base_path, paths, final_name, compress_format)
+            commands, final_name = self.encrypted([command], final_name)
+            ok = self.put_volumes(commands, final_name)
+            if not ok:
+                logging.error("%s - failed tar volumes.", self.handler_name)
+            return ok
+
+        ok, path  = self.tar(base_path, paths, final_name, compress_format, encrypt=True)
         if not ok:
             logging.error("%s - failed tar.", self.handler_name)
             return None
@@ -67,5 +200,34 @@ class Tarball(BaseHandler):
         ok = self.scp_put(path, final_name)
         if not ok:
             logging.error("%s - failed scp.", self.handler_name)
+        else:
+            self.record_artifact(final_name)
 
         return ok
+
+    def restore(self, stamp=None, target=None):
+        """
+        Streams tarball from backup host and extracts
+        it on ``target`` directory.
+        """
+        if target is None:
+            logging.error("%s - restore needs a target directory.", self.handler_name)
+            return False
+
+        suffix = r"tarball\.tar(\.xz|\.gz|\.bz2)?(\.gpg)?(\.manifest)?"
+        artifact = self.find_artifact(self.artifact_rx(suffix), stamp,
+                                      self.artifact_rx(suffix, legacy=True))
+        if artifact is None:
+            logging.error("%s - no artifact found.", self.handler_name)
+            return False
+
+        if not os.path.exists(target):
+            os.makedirs(target)
+
+        command = "{command} -x -f - -C {target}".format(
+            command = self.env.command_tar(),
+            target = shlex.quote(target),
+        )
+
+        logging.info("%s - restoring %s.", self.handler_name, artifact)
+        return self.restore_artifact(artifact, [command])
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Restore(object):
+    """
+    Restores artifacts of a list of handlers, streaming them
+    from backup host. Handlers are restored in parallel with
+    at most ``jobs`` at same time.
+
+    - ``names`` is a list of handler names to restore. If is None,
+      all handlers are restored.
+    - ``stamp`` selects artifacts with this timestamp, by default
+      newest artifacts are restored.
+    - ``target`` is a extraction directory for file handlers or
+      database name for database handlers. It is only accepted
+      when a single handler is restored.
+    """
+
+    def __init__(self, handlers, names=None, stamp=None, target=None, jobs=1):
+        self.handlers = handlers
+        self.names = names
+        self.stamp = stamp
+        self.target = target
+        self.jobs = jobs
+
+    def selected_handlers(self):
+        if not self.names:
+            return self.handlers
+        return [handler for handler in self.handlers if handler.name in self.names]
+
+    def restore_handler(self, handler):
+        logging.info("%s - starting restore (%s).", handler.handler_name, handler.name)
+        try:
+            ok = handler.restore(stamp=self.stamp, target=self.target)
+        except NotImplementedError:
+            logging.error("%s - restore is not supported.", handler.handler_name)
+            return False
+        except Exception:
+            logging.exception("%s - restore failed with exception (%s).",
+                              handler.handler_name, handler.name)
+            return False
+
+        if not ok:
+            logging.error("%s - restore failed (%s).", handler.handler_name, handler.name)
+        return ok
+
+    def run(self):
+        handlers = self.selected_handlers()
+        if not handlers:
+            logging.error("Restore - no handlers found.")
+            return False
+
+        if self.target is not None and len(handlers) > 1:
+            logging.error("Restore - target is shared by %s handlers, select one with --handler.",
+                          len(handlers))
+            return False
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            results = list(executor.map(self.restore_handler, handlers))
+
+        return all(results)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import re
+import datetime
+
+stamp_format = "%Y-%m-%d_%H%M"
+stamp_rx = re.compile(r"\.(?P<stamp>\d{4}-\d{2}-\d{2}_\d{4})\.")
+
+periods = (
+    ("keep_daily", lambda date: date.date()),
+    ("keep_weekly", lambda date: date.isocalendar()[:2]),
+    ("keep_monthly", lambda date: (date.year, date.month)),
+)
+
+
+def artifact_stamp(name):
+    """
+    Returns timestamp of artifact name or None if
+    name does not have one.
+    """
+    match = stamp_rx.search(name)
+    if match is None:
+        return None
+    return match.group("stamp")
+
+
+def select_expired(stamps, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    """
+    Returns a sorted list of expired timestamps with a GFS policy.
+
+    For each period (day, ISO week and month) newest timestamp of the
+    ``keep_*`` most recent periods with backups is kept. Newest timestamp
+    is always kept. If no policy is set, nothing expires.
+    """
+    policy = {"keep_daily": int(keep_daily or 0),
+              "keep_weekly": int(keep_weekly or 0),
+              "keep_monthly": int(keep_monthly or 0)}
+
+    stamps = set(stamps)
+    if not stamps or not any(policy.values()):
+        return []
+
+    dates = sorted(((datetime.datetime.strptime(stamp, stamp_format), stamp)
+                    for stamp in stamps), reverse=True)
+
+    keep = set([dates[0][1]])
+    for option, period in periods:
+        seen = set()
+        for date, stamp in dates:
+            if len(seen) >= policy[option]:
+                break
+            key = period(date)
+            if key not in seen:
+                seen.add(key)
+                keep.add(stamp)
+
+    return sorted(stamps - keep)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import signal
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncRunner(object):
+    """
+    Runs handlers jobs on a single asyncio event loop with at most
+    ``concurrency`` handlers at same time.
+
+    Handlers with a asyncio implementation (``arun``) run as tasks of
+    the loop and handlers without it run on a thread of loop executor.
+    On SIGINT or SIGTERM (or calling ``cancel``) all running handlers are
+    cancelled and their processes are killed; handlers running on threads
+    can not be interrupted and runner waits for them.
+    """
+
+    def __init__(self, handlers, concurrency=1):
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+        self.tasks = []
+
+    async def run_handler(self, handler, semaphore):
+        async with semaphore:
+            logging.info("%s - starting job (%s).", handler.handler_name, handler.name)
+            return await handler.arun_job()
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.tasks = [loop.create_task(self.run_handler(handler, semaphore))
+                      for handler in self.handlers]
+
+        signals = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.cancel)
+                signals.append(signum)
+            except (ValueError, RuntimeError):
+                # not on main thread
+                pass
+
+        try:
+            results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            for signum in signals:
+                loop.remove_signal_handler(signum)
+
+        ok = True
+        for handler, result in zip(self.handlers, results):
+            if isinstance(result, asyncio.CancelledError):
+                ok = False
+            elif isinstance(result, BaseException):
+                logging.error("%s - failed (%s): %s: %s", handler.handler_name, handler.name,
+                              result.__class__.__name__, result)
+                ok = False
+            elif not result:
+                ok = False
+        return ok
+
+    def cancel(self):
+        """
+        Cancels all pending and running handlers.
+        """
+        logging.error("Runner - cancelling %s handlers.",
+                      len([task for task in self.tasks if not task.done()]))
+        for task in self.tasks:
+            task.cancel()
+
+    def run(self):
+        """
+        Runs all handlers and returns True if all are success.
+        """
+        return asyncio.run(self.main())
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import time
+import queue
+import base64
+import hashlib
+import logging
+import datetime
+import threading
+import http.client
+
+from urllib.parse import urlparse, quote
+from xml.etree import ElementTree
+
+from .exceptions import S3Error
+
+
+class S3Client(object):
+    """
+    Minimal client for S3 compatible object storages, signed with AWS
+    signature version 4 and with path style urls (``{endpoint}/{bucket}/{key}``),
+    that works with AWS and with local servers like MinIO.
+
+    Streams are uploaded with multipart uploads of ``part_size`` bytes
+    parts, with ``concurrency`` parts uploaded at same time and each part
+    retried ``retries`` times. At most ``2 * concurrency + 1`` parts are
+    on memory.
+    """
+
+    default_region = "us-east-1"
+    default_part_size = 64 * 1024 * 1024
+    min_part_size = 5 * 1024 * 1024
+    default_concurrency = 4
+    default_retries = 3
+    retry_delay = 1
+    max_parts = 10000
+    delete_batch_size = 1000
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region=None,
+                 part_size=None, concurrency=None, retries=None):
+        url = urlparse(endpoint)
+        self.secure = url.scheme == "https"
+        self.host = url.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region or self.default_region
+        self.part_size = int(part_size or self.default_part_size)
+        self.concurrency = int(concurrency or self.default_concurrency)
+        self.retries = int(self.default_retries if retries is None else retries)
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Returns a http connection of current thread.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, timeout=300)
+        return conn
+
+    def signing_key(self, date):
+        key = ("AWS4" + self.secret_key).encode("utf-8")
+        for value in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, value.encode("utf-8"), hashlib.sha256).digest()
+        return key
+
+    def signature(self, method, uri, query, headers, payload_hash, now):
+        """
+        Returns authorization header value of a request. ``headers``
+        must contain host, x-amz-date and x-amz-content-sha256.
+        """
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        scope = "{0}/{1}/s3/aws4_request".format(date, self.region)
+
+        names = sorted(name.lower() for name in headers)
+        values = dict((name.lower(), " ".join(str(value).split()))
+                      for name, value in headers.items())
+        signed_headers = ";".join(names)
+
+        canonical_request = "\n".join([
+            method,
+            uri,
+            self.canonical_query(query),
+            "".join("{0}:{1}\n".format(name, values[name]) for name in names),
+            signed_headers,
+            payload_hash,
+        ])
+
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+
+        signature = hmac.new(self.signing_key(date), string_to_sign.encode("utf-8"),
+                             hashlib.sha256).hexdigest()
+        return ("AWS4-HMAC-SHA256 Credential={0}/{1}, SignedHeaders={2}, "
+                "Signature={3}").format(self.access_key, scope, signed_headers, signature)
+
+    def canonical_query(self, query):
+        return "&".join("{0}={1}".format(quote(str(key), safe="-_.~"), quote(str(value), safe="-_.~"))
+                        for key, value in sorted((query or {}).items()))
+
+    def request(self, method, key="", query=None, body=b"", headers=None, stream=False):
+        """
+        Executes a signed request and returns response and its body
+        (or response not readed if ``stream``). Raises ``S3Error`` if
+        request fails.
+        """
+        uri = quote("/{0}/{1}".format(self.bucket, key) if key else "/{0}".format(self.bucket),
+                    safe="/-_.~")
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        headers = dict(headers or {})
+        headers["host"] = self.host
+        headers["x-amz-date"] = now.strftime("%Y%m%dT%H%M%SZ")
+        headers["x-amz-content-sha256"] = hashlib.sha256(body).hexdigest()
+        headers["Authorization"] = self.signature(method, uri, query, headers,
+                                                  headers["x-amz-content-sha256"], now)
+
+        url = uri
+        if query:
+            url = "{0}?{1}".format(uri, self.canonical_query(query))
+
+        conn = self.connection()
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            response = conn.getresponse()
+            if stream and response.status < 300:
+                return response, None
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self._local.conn = None
+            raise S3Error("{0} {1}: {2}".format(method, key, e))
+
+        if response.status >= 300:
+            raise S3Error("{0} {1}: {2} {3}: {4}".format(method, key, response.status,
+                                                         response.reason, data[:500]),
+                          status=response.status)
+        return response, data
+
+    def retry(self, fn, *args):
+        """
+        Calls ``fn`` retrying it ``retries`` times if fails,
+        waiting ``retry_delay`` seconds doubled on each retry.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args)
+            except S3Error as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logging.error("S3 - %s, retrying in %s seconds.", e, delay)
+                time.sleep(delay)
+
+    def put_object(self, key, data):
+        self.request("PUT", key, body=data)
+
+    def get_object(self, key):
+        """
+        Returns a not readed response with object content.
+        """
+        response, _ = self.request("GET", key, stream=True)
+        return response
+
+    def create_multipart_upload(self, key):
+        _, data = self.request("POST", key, query={"uploads": ""})
+        return self.find_text(data, "UploadId")
+
+    def upload_part(self, key, upload_id, number, data):
+        response, _ = self.request("PUT", key, body=data,
+                                   query={"partNumber": number, "uploadId": upload_id})
+        return response.getheader("ETag")
+
+    def complete_multipart_upload(self, key, upload_id, etags):
+        body = "<CompleteMultipartUpload>{0}</CompleteMultipartUpload>".format("".join(
+            "<Part><PartNumber>{0}</PartNumber><ETag>{1}</ETag></Part>".format(number, etags[number])
+            for number in sorted(etags)))
+        _, data = self.request("POST", key, query={"uploadId": upload_id},
+                               body=body.encode("utf-8"))
+        # errors can be returned with status 200
+        if b"<Error>" in data:
+            raise S3Error("POST {0}: {1}".format(key, data[:500]))
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.request("DELETE", key, query={"uploadId": upload_id})
+
+    def delete_objects(self, keys):
+        """
+        Deletes objects with batched delete requests.
+        """
+        keys = list(keys)
+        for i in range(0, len(keys), self.delete_batch_size):
+            body = "<Delete><Quiet>true</Quiet>{0}</Delete>".format("".join(
+                "<Object><Key>{0}</Key></Object>".format(self.escape(key))
+                for key in keys[i:i + self.delete_batch_size])).encode("utf-8")
+            md5 = base64.b64encode(hashlib.md5(body).digest()).decode("ascii")
+            _, data = self.request("POST", query={"delete": ""}, body=body,
+                                   headers={"Content-MD5": md5})
+
+            # errors of each key are returned with status 200
+            errors = self.find_errors(data)
+            if errors:
+                raise S3Error("POST delete: {0}".format(", ".join(
+                    "{0} ({1})".format(key, code) for key, code in errors)))
+
+    def list_objects(self, prefix):
+        """
+        Returns a list with keys of all objects with ``prefix``.
+        """
+        keys, token = [], None
+        while True:
+            query = {"list-type": 2, "prefix": prefix}
+            if token is not None:
+                query["continuation-token"] = token
+            _, data = self.request("GET", query=query)
+
+            root = ElementTree.fromstring(data)
+            for element in root.iter():
+                if element.tag.endswith("}Key") or element.tag == "Key":
+                    keys.append(element.text)
+
+            token = self.find_text(data, "NextContinuationToken")
+            if token is None:
+                return keys
+
+    def read_part(self, stream):
+        """
+        Reads a part from stream. Pipes can return less
+        bytes than requested before the end of stream.
+        """
+        chunks, size = [], 0
+        while size < self.part_size:
+            chunk = stream.read(self.part_size - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b"".join(chunks)
+
+    def upload_stream(self, stream, key, finished=None):
+        """
+        Uploads a stream to ``key``. Streams smaller than one part are
+        uploaded with a single request and others with a multipart upload.
+        Object is created only if ``finished`` callable (if any) confirms
+        that stream producer is success, otherwise upload is aborted and
+        ``S3Error`` is raised.
+        """
+        data = self.read_part(stream)
+        if len(data) < self.part_size:
+            if finished is not None and not finished():
+                raise S3Error("PUT {0}: stream producer failed".format(key))
+            self.retry(self.put_object, key, data)
+            return
+
+        upload_id = self.retry(self.create_multipart_upload, key)
+        pending = queue.Queue(maxsize=self.concurrency)
+        failed = threading.Event()
+        etags, errors = {}, []
+
+        def upload():
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+
+                # workers never stop before the end of queue, otherwise
+                # producer would be blocked forever on a full queue
+                number, data = item
+                if not failed.is_set():
+                    try:
+                        etags[number] = self.retry(self.upload_part, key, upload_id, number, data)
+                    except S3Error as e:
+                        errors.append(e)
+                        failed.set()
+                    except Exception as e:
+                        errors.append(S3Error("PUT {0} part {1}: {2}: {3}".format(
+                            key, number, e.__class__.__name__, e)))
+                        failed.set()
+
+        threads = [threading.Thread(target=upload) for x in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        number = 1
+        try:
+            while data and not failed.is_set():
+                if number > self.max_parts:
+                    errors.append(S3Error("PUT {0}: more than {1} parts, part size is too "
+                                          "small".format(key, self.max_parts)))
+                    failed.set()
+                    break
+                pending.put((number, data))
+                # release part before reading next one
+                data = None
+                number += 1
+                data = self.read_part(stream)
+        finally:
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+        if not failed.is_set() and finished is not None and not finished():
+            errors.append(S3Error("PUT {0}: stream producer failed".format(key)))
+            failed.set()
+
+        if not failed.is_set():
+            try:
+                self.retry(self.complete_multipart_upload, key, upload_id, etags)
+                return
+            except S3Error as e:
+                errors.append(e)
+
+        try:
+            self.abort_multipart_upload(key, upload_id)
+        except S3Error as e:
+            logging.error("S3 - failed aborting upload of %s: %s", key, e)
+        raise errors[0]
+
+    def upload_file(self, path, key):
+        with open(path, "rb") as f:
+            self.upload_stream(f, key)
+
+    def find_text(self, data, tag):
+        root = ElementTree.fromstring(data)
+        for element in root.iter():
+            if element.tag == tag or element.tag.endswith("}" + tag):
+                return element.text
+        return None
+
+    def find_errors(self, data):
+        """
+        Returns a list of (key, code) tuples of ``Error``
+        elements of a response.
+        """
+        errors = []
+        for element in ElementTree.fromstring(data).iter():
+            if element.tag == "Error" or element.tag.endswith("}Error"):
+                fields = dict((child.tag.split("}")[-1], child.text) for child in element)
+                errors.append((fields.get("Key"), fields.get("Code")))
+        return errors
+
+    def escape(self, value):
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+import logging
+import threading
+
+
+def alive(p):
+    """
+    Returns True if a ``subprocess.Popen`` or a
+    ``asyncio.subprocess.Process`` is running.
+    """
+    if hasattr(p, "poll"):
+        return p.poll() is None
+    return p.returncode is None
+
+
+class Supervisor(threading.Thread):
+    """
+    Watches a group of processes and terminates them when ``deadline``
+    (absolute time) is reached, or when no bytes are readed or written
+    by them for ``stall_timeout`` seconds.
+
+    With ``pressure`` (a tuple of high and low thresholds), processes are
+    paused (SIGSTOP) while host cpu or io pressure (``some avg10`` from
+    /proc/pressure) is over high threshold and resumed (SIGCONT) when it
+    falls under low threshold. Paused time is not considered a stall.
+
+    Processes can be ``subprocess.Popen`` or asyncio subprocesses, and
+    must be started with ``start_new_session=True`` because
+    each one is terminated with its whole process group, and io counters
+    are collected from all processes of its session (from /proc, stall
+    detection is disabled if it is not available).
+    """
+
+    poll_interval = 1
+    kill_grace = 10
+
+    pressure_resources = ("cpu", "io")
+
+    def __init__(self, procs, deadline=None, stall_timeout=None, pressure=None,
+                 name="Supervisor"):
+        super(Supervisor, self).__init__()
+        self.daemon = True
+        self.procs = procs
+        self.deadline = deadline
+        self.stall_timeout = stall_timeout
+        self.pressure = pressure
+        self.paused = False
+        self.label = name
+        self.reason = None
+        self._finished = threading.Event()
+
+    def running(self):
+        return any(alive(p) for p in self.procs)
+
+    def io_counter(self):
+        """
+        Returns total bytes readed and written by all processes of
+        supervised sessions or None if it can not be known.
+        """
+        sessions = set(p.pid for p in self.procs)
+        total, found = 0, False
+
+        try:
+            pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+        except OSError:
+            return None
+
+        for pid in pids:
+            try:
+                with open("/proc/{0}/stat".format(pid)) as f:
+                    # comm field can contain spaces
+                    fields = f.read().rsplit(")", 1)[1].split()
+                if int(fields[3]) not in sessions:
+                    continue
+
+                with open("/proc/{0}/io".format(pid)) as f:
+                    for line in f:
+                        key, value = line.split(":")
+                        if key in ("rchar", "wchar"):
+                            total += int(value)
+                found = True
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+
+        return total if found else None
+
+    def host_pressure(self):
+        """
+        Returns the greatest ``some avg10`` value of pressure
+        resources or None if PSI is not available.
+        """
+        values = []
+        for resource in self.pressure_resources:
+            try:
+                with open("/proc/pressure/{0}".format(resource)) as f:
+                    for line in f:
+                        if line.startswith("some "):
+                            fields = dict(x.split("=") for x in line.split()[1:])
+                            values.append(float(fields["avg10"]))
+            except (IOError, OSError, KeyError, ValueError):
+                continue
+
+        return max(values) if values else None
+
+    def regulate(self):
+        """
+        Pauses or resumes processes depending on host pressure.
+        """
+        pressure = self.host_pressure()
+        if pressure is None:
+            return
+
+        high, low = self.pressure
+        if not self.paused and pressure >= high:
+            logging.info("%s - host pressure %s, pausing processes.", self.label, pressure)
+            self.signal(signal.SIGSTOP)
+            self.paused = True
+        elif self.paused and pressure <= low:
+            logging.info("%s - host pressure %s, resuming processes.", self.label, pressure)
+            self.signal(signal.SIGCONT)
+            self.paused = False
+
+    def run(self):
+        last_io, last_progress = None, time.time()
+
+        while not self._finished.wait(self.poll_interval):
+            if not self.running():
+                return
+
+            now = time.time()
+            if self.deadline is not None and now >= self.deadline:
+                self.terminate("deadline reached")
+                return
+
+            if self.pressure is not None:
+                self.regulate()
+
+            if self.stall_timeout is not None:
+                io = self.io_counter()
+                if self.paused or io is None or io != last_io:
+                    last_io, last_progress = io, now
+                elif now - last_progress >= self.stall_timeout:
+                    self.terminate("stalled for {0} seconds".format(self.stall_timeout))
+                    return
+
+    def signal(self, signum):
+        for p in self.procs:
+            if alive(p):
+                try:
+                    os.killpg(p.pid, signum)
+                except OSError:
+                    pass
+
+    def terminate(self, reason):
+        """
+        Terminates all process groups with SIGTERM and, if they
+        are running after ``kill_grace`` seconds, with SIGKILL.
+        """
+        self.reason = reason
+        logging.error("%s - %s, terminating processes.", self.label, reason)
+
+        self.signal(signal.SIGTERM)
+        if self.paused:
+            self.signal(signal.SIGCONT)
+            self.paused = False
+        limit = time.time() + self.kill_grace
+        while self.running() and time.time() < limit:
+            time.sleep(0.1)
+        self.signal(signal.SIGKILL)
+
+    def stop(self):
+        """
+        Stops supervision without waiting for supervisor thread.
+        """
+        self._finished.set()
+
+    def finish(self):
+        """
+        Stops supervision and returns False if processes
+        were terminated by supervisor.
+        """
+        self.stop()
+        self.join()
+        return self.reason is None
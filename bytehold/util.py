@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import os
+import errno
+import fcntl
 from subprocess import Popen, PIPE
 from .exceptions import FileDoesNotExists
 
@@ -36,3 +38,101 @@ def resolve_absolute_path(name, params="", returncodeok=0):
     if params:
         return "{cmd} {params}".format(cmd=cmd, params=params)
     return cmd
+
+
+def parse_size(size):
+    """
+    Parse a human readable size like ``512M`` or ``2G``
+    and return the number of bytes.
+    """
+    if isinstance(size, int):
+        return size
+
+    size = size.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+    if size.endswith("B"):
+        size = size[:-1]
+
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+FICLONE = 0x40049409
+
+def _copy_range(in_fd, out_fd, offset, count):
+    """
+    Copy ``count`` bytes at ``offset`` between file descriptors
+    without pass data through user space when is possible.
+    """
+    end = offset + count
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(in_fd, out_fd, end - offset, offset, offset)
+                if copied == 0:
+                    return
+                offset += copied
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+
+    os.lseek(out_fd, offset, os.SEEK_SET)
+    try:
+        while offset < end:
+            sent = os.sendfile(out_fd, in_fd, offset, end - offset)
+            if sent == 0:
+                return
+            offset += sent
+        return
+    except OSError as e:
+        if e.errno not in (errno.ENOSYS, errno.EINVAL):
+            raise
+
+    os.lseek(in_fd, offset, os.SEEK_SET)
+    os.lseek(out_fd, offset, os.SEEK_SET)
+    while offset < end:
+        chunk = os.read(in_fd, min(1024 * 1024, end - offset))
+        if not chunk:
+            return
+        os.write(out_fd, chunk)
+        offset += len(chunk)
+
+
+def copy_file(src, dst):
+    """
+    Copy file contents using kernel zero copy primitives. Tries first
+    a reflink (copy on write clone), and if filesystem does not support
+    it, copies only data regions of file with copy_file_range (or
+    sendfile) preserving holes of sparse files.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(in_fd).st_size
+
+        try:
+            fcntl.ioctl(out_fd, FICLONE, in_fd)
+            return
+        except (IOError, OSError):
+            pass
+
+        offset = 0
+        while offset < size:
+            try:
+                data = os.lseek(in_fd, offset, os.SEEK_DATA)
+                hole = os.lseek(in_fd, data, os.SEEK_HOLE)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # no more data, only a hole until end of file
+                    break
+                data, hole = offset, size
+            except AttributeError:
+                data, hole = offset, size
+
+            _copy_range(in_fd, out_fd, data, hole - data)
+            offset = hole
+
+        os.ftruncate(out_fd, size)
@@ -1,8 +1,13 @@
 from tests.test_base import *
 from tests.test_env import *
+from tests.test_fleet import *
 from tests.test_handler_base import *
 from tests.test_handler_mysql import *
 from tests.test_handler_postgresql import *
 from tests.test_handler_rsync import *
 from tests.test_handler_tarball import *
+from tests.test_restore import *
+from tests.test_retention import *
+from tests.test_s3 import *
+from tests.test_supervisor import *
 from tests.test_util import *
@@ -72,3 +72,12 @@ class EnvironmentTest(TestCase):
         self.assertEqual(env.config['testkey'], 'testvalue')
         env.extend(testkey='testvalue2')
         self.assertEqual(env.config['testkey'], 'testvalue2')
+
+    def test_isolated(self):
+        env = Environment()
+        with Environment.isolated(name='isolated') as isolated:
+            self.assertEqual(id(Environment()), id(isolated))
+            self.assertNotEqual(id(env), id(isolated))
+            self.assertEqual(Environment().name(), 'isolated')
+            self.assertFalse(isolated.config is env.config)
+        self.assertEqual(id(Environment()), id(env))
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from bytehold.fleet import *
+
+
+class FleetTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.write("db1.ini", "[global]\nname = db1\nremote_host = backup@backup1\n"
+                              "remote_path = /backups\n\n"
+                              "[tarball:etc]\npaths = etc\nbase_path = /\n"
+                              "[tarball:home]\npaths = home\nbase_path = /\n")
+        self.write("db2.py", "from bytehold import Environment\n"
+                             "from bytehold.handlers import Tarball\n"
+                             "Environment(name='db2', remote_host='backup@backup2', "
+                             "remote_path='/backups')\n"
+                             "Tarball(name='etc', paths='etc', base_path='/')\n")
+        self.write("inventory.ini", "[fleet]\nbh_command = true\n\n"
+                                    "[env:db1]\nconfig = db1.ini\n\n"
+                                    "[env:db2]\nssh_host = root@db2\npython_config = db2.py\n")
+        self.fleet = Fleet(os.path.join(self.tmpdir, "inventory.ini"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmpdir, name), "w") as f:
+            f.write(content)
+
+    def test_load(self):
+        for entry in self.fleet.entries:
+            entry.load()
+
+        db1, db2 = self.fleet.entries
+        self.assertEqual((db1.destination, len(db1.handlers)), ("backup@backup1", 2))
+        self.assertEqual((db2.destination, len(db2.handlers)), ("backup@backup2", 1))
+
+    def test_command(self):
+        db1, db2 = self.fleet.entries
+        db2.load()
+        command, stdin = self.fleet.command(db2)
+        self.assertIn("mktemp --suffix=.py", command)
+        self.assertNotIn("/dev/stdin", command)
+        self.assertIn(b"Tarball", stdin)
+
+    def test_run(self):
+        self.fleet.entries[1].ssh_host = None
+        self.assertTrue(self.fleet.run())
+
+        # an exception executing one entry must not block the others
+        def execute(entry):
+            raise OSError("failed")
+
+        results = []
+        self.fleet.execute = execute
+        thread = threading.Thread(target=lambda: results.append(self.fleet.run()))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [False])
@@ -0,0 +1,467 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import threading
+from unittest import TestCase
+from bytehold.env import Environment
+from bytehold.handlers.base import *
+from bytehold.runner import AsyncRunner
+
+
+class BaseHandlerJobTest(TestCase):
+    class Handler(BaseHandler):
+        attempts = 0
+
+        def run(self):
+            self.attempts += 1
+            self.sched_for_delete(self.config["path"])
+            raise InvalidConfiguration("s3_bucket is mandatory for s3 destination.")
+
+        async def arun(self):
+            return self.run()
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.handler = self.Handler(name='test', path=self.path, retries=1, retry_delay=0,
+                                    auto_register=False)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def test_run_job_exception(self):
+        self.assertFalse(self.handler.run_job())
+        self.assertEqual(self.handler.attempts, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_arun_job_exception(self):
+        self.assertFalse(asyncio.run(self.handler.arun_job()))
+        self.assertEqual(self.handler.attempts, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class BaseHandlerThrottlingTest(TestCase):
+    def setUp(self):
+        self.cgroup = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', remote_host='backup@localhost',
+                                        remote_path='/backups', scp_command='scp')
+        self.env.__enter__()
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.cgroup)
+
+    def test_cgroup(self):
+        handler = BaseHandler(name='test', cgroup=self.cgroup, auto_register=False)
+        output = os.path.join(self.cgroup, "output")
+        self.assertTrue(handler.execute("sh -c 'echo $$ > {0}'".format(output)))
+        with open(os.path.join(self.cgroup, "cgroup.procs")) as f:
+            pid = f.read()
+        with open(output) as f:
+            self.assertEqual(f.read(), pid)
+
+        # command is not executed if cgroup can not be joined
+        os.remove(output)
+        os.remove(os.path.join(self.cgroup, "cgroup.procs"))
+        os.makedirs(os.path.join(self.cgroup, "cgroup.procs"))
+        self.assertFalse(handler.execute("sh -c 'echo $$ > {0}'".format(output)))
+        self.assertFalse(os.path.exists(output))
+
+    def test_scp_bwlimit(self):
+        handler = BaseHandler(name='test', bwlimit=1000, auto_register=False)
+        self.assertEqual(handler.scp_command("a", "b"), "scp -l 8000 a backup@localhost:/backups/test/b")
+        self.assertEqual(handler.scp_command("a", "b", 500), "scp -l 4000 a backup@localhost:/backups/test/b")
+
+        limits = []
+        def put(local_path, final_name, bwlimit=None):
+            limits.append(bwlimit)
+            return True
+
+        handler = BaseHandler(name='test', bwlimit=1000, volume_size='1K', upload_workers=4,
+                              auto_register=False)
+        handler.scp_put = put
+        handler.scp_put_atomic = lambda local_path, final_name: True
+        handler.record_artifact = lambda final_name, files=None: True
+        self.assertTrue(handler.stream_volumes(io.BytesIO(os.urandom(2500)), 'a.tar'))
+        self.assertEqual(limits, [250, 250, 250])
+        handler.cleanup()
+
+
+class BaseHandlerVolumesTest(TestCase):
+    def setUp(self):
+        self.remote = tempfile.mkdtemp()
+        self.handler = BaseHandler(name='test', volume_size='1K', auto_register=False)
+        self.handler.scp_put = self.put
+        self.handler.scp_put_atomic = self.put
+
+    def tearDown(self):
+        shutil.rmtree(self.remote)
+
+    def put(self, local_path, final_name, **kwargs):
+        shutil.copy(local_path, os.path.join(self.remote, final_name))
+        return True
+
+    def test_volume_size(self):
+        self.assertEqual(self.handler.volume_size(), 1024)
+        self.assertEqual(BaseHandler(auto_register=False).volume_size(), None)
+
+    def test_stream_volumes(self):
+        data = os.urandom(2500)
+        self.assertTrue(self.handler.stream_volumes(io.BytesIO(data), 'a.tar'))
+        self.assertEqual(sorted(os.listdir(self.remote)),
+                         ['a.tar.manifest', 'a.tar.vol0001', 'a.tar.vol0002', 'a.tar.vol0003'])
+
+        with open(os.path.join(self.remote, 'a.tar.manifest')) as f:
+            manifest = [line.split() for line in f]
+
+        joined = b''
+        for checksum, name in manifest:
+            with open(os.path.join(self.remote, name), 'rb') as f:
+                volume = f.read()
+            self.assertEqual(hashlib.sha256(volume).hexdigest(), checksum)
+            joined += volume
+        self.assertEqual(joined, data)
+
+    def test_stream_volumes_producer_failure(self):
+        removed = []
+        self.handler.remove_remote = lambda names: removed.extend(names)
+        self.assertFalse(self.handler.stream_volumes(io.BytesIO(os.urandom(2500)), 'a.tar',
+                                                     finished=lambda: False))
+        self.assertFalse(os.path.exists(os.path.join(self.remote, 'a.tar.manifest')))
+        self.assertEqual(sorted(removed), ['a.tar.vol0001', 'a.tar.vol0002', 'a.tar.vol0003'])
+
+    def test_stream_volumes_upload_failure(self):
+        self.handler.scp_put = lambda local_path, final_name, **kwargs: False
+        self.assertFalse(self.handler.stream_volumes(io.BytesIO(os.urandom(5000)), 'a.tar'))
+        self.assertFalse(os.path.exists(os.path.join(self.remote, 'a.tar.manifest')))
+
+    def test_stream_volumes_upload_exception(self):
+        def put(local_path, final_name, **kwargs):
+            raise FileNotFoundError("scp")
+
+        removed, results = [], []
+        self.handler.scp_put = put
+        self.handler.remove_remote = lambda names: removed.extend(names)
+
+        # a failed worker must not block the producer
+        thread = threading.Thread(target=lambda: results.append(
+            self.handler.stream_volumes(io.BytesIO(os.urandom(10000)), 'a.tar')))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [False])
+        self.assertTrue(removed)
+        self.handler.cleanup()
+
+
+# ssh stand-in: executes remote command with local shell. Uploads
+# of files with "fail" on their name are interrupted and uploads of
+# files with "corrupt" on their name lose bytes.
+SSH_SHIM = r"""
+import sys, subprocess
+
+host, command = sys.argv[1:]
+if "fail" in command and "cat >" in command:
+    sys.stdin.buffer.read(1000)
+    sys.exit(255)
+if "corrupt" in command and "cat >" in command:
+    sys.stdin.buffer.read(1000)
+    command = command.replace("cat >", "head -c -1 >")
+sys.exit(subprocess.call(["sh", "-c", command]))
+"""
+
+
+class BaseHandlerParallelUploadTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        shim = os.path.join(self.tmpdir, "ssh.py")
+        with open(shim, "w") as f:
+            f.write(SSH_SHIM)
+
+        self.env = Environment.isolated(name='test', remote_host='backup@localhost',
+                                        remote_path=os.path.join(self.tmpdir, "remote"),
+                                        ssh_command="{0} {1}".format(sys.executable, shim))
+        self.env.__enter__()
+        self.handler = BaseHandler(name='test', auto_register=False)
+        self.handler.parallel_upload_min_size = 1
+        self.handler.stream_chunk_size = 64 * 1024
+        self.remote_path = self.handler.env.remote_path()
+        os.makedirs(self.remote_path)
+
+        self.path = os.path.join(self.tmpdir, "a.tar")
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 12345))
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def sha256(self, path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def test_scp_put_parallel(self):
+        self.assertTrue(self.handler.scp_put(self.path, "b.tar", streams=4))
+        self.assertEqual(os.listdir(self.remote_path), ["b.tar"])
+        self.assertEqual(self.sha256(os.path.join(self.remote_path, "b.tar")),
+                         self.sha256(self.path))
+
+    def test_scp_put_parallel_failure(self):
+        self.assertFalse(self.handler.scp_put_parallel(self.path, "fail.tar", 4))
+        self.assertEqual(os.listdir(self.remote_path), [])
+
+    def test_scp_put_parallel_checksum(self):
+        self.assertFalse(self.handler.scp_put_parallel(self.path, "corrupt.tar", 4))
+        self.assertEqual(os.listdir(self.remote_path), [])
+
+
+class BaseHandlerRestoreTest(TestCase):
+    def setUp(self):
+        Environment().extend(name='test', remote_path='/backups')
+        self.handler = BaseHandler(name='test', auto_register=False)
+        self.listing = "\n".join([
+            "test.2013-01-01_0200.test.postgresql.sql.xz",
+            "test.2013-01-03_0200.test.postgresql.sql.xz.manifest",
+            "test.2013-01-03_0200.test.postgresql.sql.xz.vol0001",
+            "test.2013-01-02_0200.test.postgresql.sql.xz",
+            "other.2013-01-04_0200.test.postgresql.sql.xz",
+            "test.2013-01-04_0200.test.tarball.tar.xz",
+            "test.2013-01-05_0200.other.postgresql.sql.xz",
+        ])
+        self.handler.ssh_output = lambda command: (True, self.listing)
+        self.rx = self.handler.artifact_rx(r"postgresql\.sql(\.xz)?(\.manifest)?")
+
+    def test_find_artifact(self):
+        self.assertEqual(self.handler.find_artifact(self.rx),
+                         "test.2013-01-03_0200.test.postgresql.sql.xz.manifest")
+        self.assertEqual(self.handler.find_artifact(self.rx, "2013-01-02_0200"),
+                         "test.2013-01-02_0200.test.postgresql.sql.xz")
+        self.assertEqual(self.handler.find_artifact(self.rx, "2013-01-04_0200"), None)
+
+    def test_find_artifact_index(self):
+        # index entries of other handlers are ignored
+        self.handler.read_index = lambda: [
+            ("2013-01-02_0200", "basehandler:test", ["test.2013-01-02_0200.test.postgresql.sql.xz"]),
+            ("2013-01-03_0200", "basehandler:other", ["test.2013-01-03_0200.test.postgresql.sql.xz"]),
+        ]
+        self.assertEqual(self.handler.find_artifact(self.rx),
+                         "test.2013-01-02_0200.test.postgresql.sql.xz")
+
+    def test_find_artifact_legacy(self):
+        legacy_rx = self.handler.artifact_rx(r"postgresql\.sql(\.xz)?", legacy=True)
+        self.listing = ""
+        self.handler.read_index = lambda: [
+            ("2013-01-01_0200", "basehandler:test", ["test.2013-01-01_0200.postgresql.sql.xz"]),
+        ]
+        self.assertEqual(self.handler.find_artifact(self.rx), None)
+        self.assertEqual(self.handler.find_artifact(self.rx, legacy_rx=legacy_rx),
+                         "test.2013-01-01_0200.postgresql.sql.xz")
+
+        # artifacts with handler name are preferred
+        self.handler.read_index = lambda: [
+            ("2013-01-01_0200", "basehandler:test", ["test.2013-01-01_0200.postgresql.sql.xz"]),
+            ("2013-01-02_0200", "basehandler:test", ["test.2013-01-02_0200.test.postgresql.sql.xz"]),
+        ]
+        self.assertEqual(self.handler.find_artifact(self.rx, legacy_rx=legacy_rx),
+                         "test.2013-01-02_0200.test.postgresql.sql.xz")
+        self.assertEqual(self.handler.find_artifact(self.rx, "2013-01-01_0200", legacy_rx),
+                         "test.2013-01-01_0200.postgresql.sql.xz")
+
+    def test_artifact_name(self):
+        handler = BaseHandler(name='My db.1', auto_register=False)
+        handler.timestamp = lambda: "2013-01-01_0200"
+        name = handler.artifact_name("postgresql.sql.xz")
+        self.assertEqual(name, "test.2013-01-01_0200.My_db_1.postgresql.sql.xz")
+        self.assertTrue(handler.artifact_rx(r"postgresql\.sql(\.xz)?").match(name))
+        self.assertFalse(self.rx.match(name))
+
+    def test_decompress_command(self):
+        self.assertEqual(self.handler.decompress_command("a.sql.xz"), "xz -dc")
+        self.assertEqual(self.handler.decompress_command("a.tar.gz.manifest"), "gzip -dc")
+        self.assertEqual(self.handler.decompress_command("a.sql"), None)
+
+
+class BaseHandlerRestoreArtifactTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', destination='local',
+                                        remote_path=os.path.join(self.tmpdir, "remote"))
+        self.env.__enter__()
+        self.handler = BaseHandler(name='test', volume_size='1K', auto_register=False)
+        self.remote_path = self.handler.env.remote_path()
+        self.data = os.urandom(2500)
+        self.assertTrue(self.handler.stream_volumes(io.BytesIO(self.data), 'a.tar'))
+        self.output = os.path.join(self.tmpdir, "output")
+        self.command = "sh -c 'cat > {0}'".format(self.output)
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        self.handler.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_restore_artifact(self):
+        self.assertTrue(self.handler.restore_artifact("a.tar.manifest", [self.command]))
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        self.assertTrue(self.handler.restore_artifact("a.tar.vol0001", [self.command]))
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), self.data[:1024])
+
+    def test_restore_artifact_checksum(self):
+        with open(os.path.join(self.remote_path, "a.tar.vol0002"), "r+b") as f:
+            f.write(b"x")
+        self.assertFalse(self.handler.restore_artifact("a.tar.manifest", [self.command]))
+
+        os.remove(os.path.join(self.remote_path, "a.tar.vol0002"))
+        self.assertFalse(self.handler.restore_artifact("a.tar.manifest", [self.command]))
+
+
+class BaseHandlerAsyncTest(TestCase):
+    def setUp(self):
+        self.remote = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', destination='local', remote_path=self.remote)
+        self.env.__enter__()
+        self.handler = BaseHandler(name='test', auto_register=False)
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.remote)
+
+    def test_aexecute(self):
+        self.assertTrue(asyncio.run(self.handler.aexecute("true")))
+        self.assertFalse(asyncio.run(self.handler.aexecute("false")))
+
+    def test_apipeline(self):
+        async def run():
+            procs = await self.handler.apipeline(["head -c 3000000 /dev/zero", "tr '\\0' a"])
+            data = b""
+            while True:
+                chunk = await procs[-1].stdout.read(65536)
+                if not chunk:
+                    break
+                data += chunk
+            return await self.handler.await_pipeline(procs), data
+
+        ok, data = asyncio.run(run())
+        self.assertTrue(ok)
+        self.assertEqual(data, b"a" * 3000000)
+
+    def test_aput_pipeline(self):
+        remote_path = self.handler.env.remote_path()
+        self.assertTrue(asyncio.run(self.handler.aput_pipeline(["echo hello"], "a.txt")))
+        self.assertEqual(os.listdir(remote_path), ["a.txt"])
+        with open(os.path.join(remote_path, "a.txt")) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+        self.assertFalse(asyncio.run(self.handler.aput_pipeline(["echo hello", "false"], "b.txt")))
+        self.assertEqual(os.listdir(remote_path), ["a.txt"])
+
+    def test_cancel(self):
+        async def run():
+            task = asyncio.ensure_future(self.handler.aexecute("sleep 30"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.time()
+        asyncio.run(run())
+        self.assertTrue(time.time() - start < 10)
+
+    def test_runner(self):
+        class Handler(BaseHandler):
+            async def arun(self):
+                return await self.aexecute(self.config["command"])
+
+        handlers = [Handler(name=str(i), command="true", auto_register=False) for i in range(20)]
+        self.assertTrue(AsyncRunner(handlers, concurrency=5).run())
+
+        handlers.append(Handler(name="fail", command="false", auto_register=False))
+        self.assertFalse(AsyncRunner(handlers, concurrency=5).run())
+
+
+class BaseHandlerRetentionTest(TestCase):
+    def setUp(self):
+        self.remote = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', destination='local', remote_path=self.remote)
+        self.env.__enter__()
+        self.handler = BaseHandler(name='test', keep_daily=2, auto_register=False)
+        self.remote_path = self.handler.env.remote_path()
+        os.makedirs(self.remote_path)
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.remote)
+
+    def upload(self, handler, *names):
+        for name in names:
+            open(os.path.join(self.remote_path, name), "w").close()
+        self.assertTrue(handler.record_artifact(names[-1], list(names)))
+
+    def test_prune(self):
+        other = BaseHandler(name='other', auto_register=False)
+        self.upload(other, "test.2013-01-01_0200.other.a.manifest")
+        for day in range(1, 5):
+            self.upload(self.handler, "test.2013-01-0{0}_0200.test.a.vol0001".format(day),
+                        "test.2013-01-0{0}_0200.test.a.manifest".format(day))
+
+        self.assertEqual(len(self.handler.read_index()), 5)
+        self.assertTrue(self.handler.prune())
+        self.assertEqual(sorted(os.listdir(self.remote_path)), [
+            ".bytehold-index", ".bytehold-index.lock",
+            "test.2013-01-01_0200.other.a.manifest",
+            "test.2013-01-03_0200.test.a.manifest", "test.2013-01-03_0200.test.a.vol0001",
+            "test.2013-01-04_0200.test.a.manifest", "test.2013-01-04_0200.test.a.vol0001",
+        ])
+        self.assertEqual([entry[0] for entry in self.handler.read_index()],
+                         ["2013-01-01_0200", "2013-01-03_0200", "2013-01-04_0200"])
+
+        rx = self.handler.artifact_rx(r"a\.manifest")
+        self.assertEqual(self.handler.find_artifact(rx), "test.2013-01-04_0200.test.a.manifest")
+
+
+class BaseHandlerEncryptionTest(TestCase):
+    def setUp(self):
+        self.env = Environment.isolated(name='test', remote_path='/backups',
+                                        encrypt_recipients='a@example.com, b@example.com',
+                                        gpg_command='gpg')
+        self.env.__enter__()
+        self.handler = BaseHandler(name='test', auto_register=False)
+        keys = {"recipients": [{"recipient": "a@example.com", "fingerprint": "AAAA",
+                                "encryption_subkeys": ["BBBB"]}]}
+        self.handler.read_remote = lambda name: (True, json.dumps(keys))
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+
+    def test_encrypted(self):
+        commands, name = self.handler.encrypted(["pg_dump db", "xz -z6"], "a.sql.xz")
+        self.assertEqual(name, "a.sql.xz.gpg")
+        self.assertEqual(commands[-1], "gpg --batch --yes --trust-model always --compress-algo none "
+                                       "--encrypt --recipient a@example.com --recipient b@example.com")
+
+        with Environment.isolated(name='test'):
+            handler = BaseHandler(name='test', auto_register=False)
+            self.assertEqual(handler.encrypted(["pg_dump db"], "a.sql"), (["pg_dump db"], "a.sql"))
+
+    def test_artifact_ext(self):
+        self.assertEqual(self.handler.artifact_ext("/tmp/a.sql.xz"), ".xz")
+        self.assertEqual(self.handler.artifact_ext("/tmp/a.sql.xz.gpg"), ".xz.gpg")
+
+    def test_restore_commands(self):
+        self.assertEqual(self.handler.restore_commands("a.sql.xz"), ["xz -dc"])
+
+        self.handler.env.config['gpg_command'] = 'true'
+        self.assertEqual(self.handler.restore_commands("a.tar.gz.gpg.manifest"),
+                         ["true --batch --quiet --decrypt", "gzip -dc"])
+
+        # no secret key on local keyring
+        self.handler.env.config['gpg_command'] = 'false'
+        self.assertEqual(self.handler.restore_commands("a.sql.xz.gpg"), None)
@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+from bytehold.env import Environment
+from bytehold.handlers.db import *
+
+# mysqlhotcopy stand-in: copies a table file to target directory
+HOTCOPY_SHIM = r"""
+import os, sys
+
+dbname, target = sys.argv[-2:]
+os.makedirs(os.path.join(target, dbname))
+with open(os.path.join(target, dbname, "t.frm"), "w") as f:
+    f.write("table")
+"""
+
+# gpg stand-in: "encrypts" stdin with a header
+GPG_SHIM = r"""
+import sys
+
+if "--encrypt" in sys.argv:
+    sys.stdout.buffer.write(b"GPG" + sys.stdin.buffer.read())
+"""
+
+
+class MySQLBinaryTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        shim = os.path.join(self.tmpdir, "hotcopy.py")
+        with open(shim, "w") as f:
+            f.write(HOTCOPY_SHIM)
+
+        self.env = Environment.isolated(name='test', destination='local',
+                                        remote_path=os.path.join(self.tmpdir, 'remote'))
+        self.env.__enter__()
+        self.hotcopy_command = "{0} {1}".format(sys.executable, shim)
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_restore(self):
+        for compress in ('0', '1'):
+            handler = MySQL(name='main', dbname='db', user='test', type='binary',
+                            compress=compress, hotcopy_command=self.hotcopy_command,
+                            auto_register=False)
+            self.assertTrue(handler.run())
+            self.assertFalse(handler.restore())
+
+            target = os.path.join(self.tmpdir, 'restore' + compress)
+            self.assertTrue(handler.restore(target=target))
+            with open(os.path.join(target, 'db', 't.frm')) as f:
+                self.assertEqual(f.read(), "table")
+            handler.cleanup()
+
+    def test_encryption(self):
+        gpg = os.path.join(self.tmpdir, "gpg.py")
+        with open(gpg, "w") as f:
+            f.write(GPG_SHIM)
+        Environment().config.update(encrypt_recipients="a@example.com",
+                                    gpg_command="{0} {1}".format(sys.executable, gpg))
+
+        handler = MySQL(name='main', dbname='db', user='test', type='binary', compress='0',
+                        hotcopy_command=self.hotcopy_command, auto_register=False)
+        self.assertTrue(handler.run())
+        handler.cleanup()
+
+        remote_path = handler.env.remote_path()
+        artifacts = [fname for fname in os.listdir(remote_path) if "mysqlhotcopy" in fname]
+        self.assertEqual(len(artifacts), 2)
+        artifact = [fname for fname in artifacts if fname.endswith(".mysqlhotcopy.tar.gpg")][0]
+        with open(os.path.join(remote_path, artifact), "rb") as f:
+            self.assertEqual(f.read(3), b"GPG")
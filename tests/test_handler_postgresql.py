@@ -0,0 +1,278 @@
+import io
+import os
+import sys
+import shutil
+import tarfile
+import subprocess
+import tempfile
+from unittest import TestCase
+from bytehold.env import Environment
+from bytehold.handlers.db import *
+
+# gpg stand-in: "encrypts" stdin with a header
+GPG_SHIM = r"""
+import sys
+
+if "--encrypt" in sys.argv:
+    sys.stdout.buffer.write(b"GPG" + sys.stdin.buffer.read())
+"""
+
+
+class PostgreSQLWALTest(TestCase):
+    def setUp(self):
+        self.wal_dir = tempfile.mkdtemp()
+        self.handler = PostgreSQLWAL(name='test', user='test', wal_dir=self.wal_dir,
+                                     compress='0', auto_register=False)
+        self.shipped = []
+        self.handler.ship_wal = lambda path, fname: self.shipped.append(fname) or True
+
+    def tearDown(self):
+        shutil.rmtree(self.wal_dir)
+
+    def touch(self, *names):
+        for name in names:
+            open(os.path.join(self.wal_dir, name), 'w').close()
+
+    def test_completed_segments(self):
+        self.touch('000000010000000000000002', '000000010000000000000001',
+                   '000000010000000000000003.partial', '00000002.history',
+                   'catalog.json', 'pg_receivewal.pid')
+        segments, history = self.handler.completed_segments()
+        self.assertEqual(segments, ['000000010000000000000001', '000000010000000000000002'])
+        self.assertEqual(history, ['00000002.history'])
+
+    def test_start_wal_segment(self):
+        label = (b"START WAL LOCATION: 0/2000028 (file 000000010000000000000002)\n"
+                 b"CHECKPOINT LOCATION: 0/2000060\n")
+        tar_path = os.path.join(self.wal_dir, 'base.tar')
+        with tarfile.open(tar_path, 'w') as tar:
+            info = tarfile.TarInfo('backup_label')
+            info.size = len(label)
+            tar.addfile(info, io.BytesIO(label))
+
+        self.assertEqual(self.handler.start_wal_segment(tar_path),
+                         '000000010000000000000002')
+
+    def test_ship_segments(self):
+        self.touch('000000010000000000000001', '000000010000000000000002')
+        catalog = self.handler.load_catalog()
+        catalog['base_backups'].append({'stamp': 'x', 'files': [],
+                                        'wal_start': '000000010000000000000001',
+                                        'wal_end': None})
+
+        self.assertTrue(self.handler.ship_segments(catalog))
+        self.assertEqual(self.shipped, ['000000010000000000000001', '000000010000000000000002'])
+        self.assertEqual(catalog['wal_first'], '000000010000000000000001')
+        self.assertEqual(catalog['wal_last'], '000000010000000000000002')
+        self.assertEqual(catalog['base_backups'][0]['wal_end'], '000000010000000000000002')
+
+        # shipped segments are removed except the newest
+        self.assertEqual(os.listdir(self.wal_dir), ['000000010000000000000002'])
+
+        self.touch('000000010000000000000003')
+        self.shipped = []
+        self.assertTrue(self.handler.ship_segments(catalog))
+        self.assertEqual(self.shipped, ['000000010000000000000003'])
+        self.assertEqual(os.listdir(self.wal_dir), ['000000010000000000000003'])
+
+    def test_ship_segments_failed_upload(self):
+        handler = PostgreSQLWAL(name='test', user='test', wal_dir=self.wal_dir,
+                                compress='1', auto_register=False)
+        uploaded = []
+        handler.scp_put_atomic = lambda path, final_name: False
+
+        self.touch('000000010000000000000001', '000000010000000000000002')
+        catalog = handler.load_catalog()
+        self.assertFalse(handler.ship_segments(catalog))
+        handler.cleanup()
+
+        # spool segments are kept until they are uploaded
+        self.assertEqual(sorted(os.listdir(self.wal_dir)),
+                         ['000000010000000000000001', '000000010000000000000002'])
+        self.assertEqual(catalog['wal_last'], None)
+
+        def put(path, final_name):
+            with open(path, 'rb') as f:
+                uploaded.append((final_name, f.read(6)))
+            return True
+
+        handler.scp_put_atomic = put
+        self.assertTrue(handler.ship_segments(catalog))
+        self.assertEqual([name.split('.')[-2:] for name, _ in uploaded],
+                         [['000000010000000000000001', 'xz'], ['000000010000000000000002', 'xz']])
+        self.assertEqual(set(data for _, data in uploaded), set([b'\xfd7zXZ\x00']))
+        self.assertEqual(catalog['wal_last'], '000000010000000000000002')
+        self.assertEqual(os.listdir(self.wal_dir), ['000000010000000000000002'])
+
+    def test_receiver_pid(self):
+        pidfile = os.path.join(self.wal_dir, 'pg_receivewal.pid')
+        with open(pidfile, 'w') as f:
+            f.write(str(os.getpid()))
+
+        # a reused pid of another process is not the receiver
+        if os.path.isdir('/proc/self'):
+            self.assertEqual(self.handler.receiver_pid(), None)
+
+        p = subprocess.Popen([sys.executable, '-c', 'import time; print(1, flush=True); '
+                              'time.sleep(30)', 'pg_receivewal'], stdout=subprocess.PIPE)
+        try:
+            p.stdout.readline()
+            with open(pidfile, 'w') as f:
+                f.write(str(p.pid))
+            self.assertEqual(self.handler.receiver_pid(), p.pid)
+        finally:
+            p.kill()
+            p.wait()
+            p.stdout.close()
+        self.assertEqual(self.handler.receiver_pid(), None)
+
+    def test_encryption(self):
+        label = b"START WAL LOCATION: 0/2000028 (file 000000010000000000000002)\n"
+        shim = os.path.join(self.wal_dir, 'pg_basebackup.py')
+        with open(shim, 'w') as f:
+            f.write("import io, sys, tarfile\n"
+                    "target = sys.argv[sys.argv.index('-D') + 1]\n"
+                    "with tarfile.open(target + '/base.tar', 'w') as tar:\n"
+                    "    info = tarfile.TarInfo('backup_label')\n"
+                    "    info.size = {0}\n"
+                    "    tar.addfile(info, io.BytesIO({1!r}))\n".format(len(label), label))
+        gpg = os.path.join(self.wal_dir, 'gpg.py')
+        with open(gpg, 'w') as f:
+            f.write(GPG_SHIM)
+
+        uploaded = {}
+        def put(path, final_name):
+            with open(path, 'rb') as f:
+                uploaded[final_name] = f.read(3)
+            return True
+
+        with Environment.isolated(name='test', encrypt_recipients='a@example.com',
+                                  gpg_command='{0} {1}'.format(sys.executable, gpg)):
+            handler = PostgreSQLWAL(name='test', user='test', wal_dir=self.wal_dir, compress='1',
+                                    pg_basebackup_command='{0} {1}'.format(sys.executable, shim),
+                                    auto_register=False)
+            handler.scp_put_atomic = put
+            catalog = handler.load_catalog()
+            self.assertTrue(handler.base_backup(catalog))
+
+            self.touch('000000010000000000000001')
+            self.assertTrue(handler.ship_segments(catalog))
+            handler.cleanup()
+
+        base, keys = catalog['base_backups'][0]['files']
+        self.assertTrue(base.endswith('.test.postgresql-base.base.tar.xz.gpg'))
+        self.assertEqual(keys, base + '.keys.json')
+        self.assertEqual(uploaded[base], b'GPG')
+
+        segment = 'test.postgresql-wal.test.000000010000000000000001.xz.gpg'
+        self.assertEqual(uploaded[segment], b'GPG')
+        self.assertIn('test.postgresql-wal.test.keys.json', uploaded)
+        self.assertEqual(sorted(uploaded), sorted([base, keys, segment,
+                                                   'test.postgresql-wal.test.keys.json']))
+
+class PostgreSQLWALRetentionTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', destination='local',
+                                        remote_path=os.path.join(self.tmpdir, 'remote'))
+        self.env.__enter__()
+        self.handler = PostgreSQLWAL(name='test', user='test', compress='1',
+                                     wal_dir=os.path.join(self.tmpdir, 'wal'),
+                                     keep_base_backups=2, auto_register=False)
+        os.makedirs(self.handler.wal_path())
+        self.remote_path = self.handler.env.remote_path()
+        os.makedirs(self.remote_path)
+
+        catalog = self.handler.load_catalog()
+        for day, wal_start in ((1, 1), (2, 3), (3, 5)):
+            stamp = '2013-01-0{0}_0200'.format(day)
+            files = ['test.{0}.test.postgresql-base.base.tar.xz'.format(stamp)]
+            catalog['base_backups'].append({'stamp': stamp, 'files': files,
+                                            'wal_start': '0000000100000000000000{0:02X}'.format(wal_start),
+                                            'wal_end': '000000010000000000000006'})
+        catalog['wal_first'] = '000000010000000000000001'
+        catalog['wal_last'] = '000000010000000000000006'
+        self.handler.save_catalog(catalog)
+
+        names = [fname for base_backup in catalog['base_backups'] for fname in base_backup['files']]
+        names += ['test.postgresql-wal.test.0000000100000000000000{0:02X}.xz'.format(segment)
+                  for segment in range(1, 7)]
+        names += ['test.postgresql-wal.test.00000002.history.xz',
+                  'test.postgresql-wal.other.000000010000000000000001.xz']
+        for name in names:
+            open(os.path.join(self.remote_path, name), 'w').close()
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        self.handler.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_prune(self):
+        self.assertTrue(self.handler.prune())
+        self.assertEqual(sorted(os.listdir(self.remote_path)), [
+            'test.2013-01-02_0200.test.postgresql-base.base.tar.xz',
+            'test.2013-01-03_0200.test.postgresql-base.base.tar.xz',
+            'test.postgresql-wal.other.000000010000000000000001.xz',
+            'test.postgresql-wal.test.000000010000000000000003.xz',
+            'test.postgresql-wal.test.000000010000000000000004.xz',
+            'test.postgresql-wal.test.000000010000000000000005.xz',
+            'test.postgresql-wal.test.000000010000000000000006.xz',
+            'test.postgresql-wal.test.00000002.history.xz',
+            'test.postgresql-wal.test.catalog.json',
+        ])
+
+        catalog = self.handler.load_catalog()
+        self.assertEqual([b['stamp'] for b in catalog['base_backups']],
+                         ['2013-01-02_0200', '2013-01-03_0200'])
+        self.assertEqual(catalog['wal_first'], '000000010000000000000003')
+
+        # nothing to prune
+        self.assertTrue(self.handler.prune())
+        self.assertEqual(len(os.listdir(self.remote_path)), 9)
+
+
+class PostgreSQLRestoreTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = Environment.isolated(name='test', destination='local',
+                                        remote_path=os.path.join(self.tmpdir, 'remote'))
+        self.env.__enter__()
+        self.output = os.path.join(self.tmpdir, 'output')
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def handler(self, name, dbname, **kwargs):
+        return PostgreSQL(name=name, dbname=dbname, user='test', pg_dump_command='echo',
+                          psql_command="sh -c 'cat > {0}' --".format(self.output),
+                          auto_register=False, **kwargs)
+
+    def restored(self):
+        with open(self.output) as f:
+            return f.read()
+
+    def test_restore(self):
+        for compress in ('0', '1'):
+            handler = self.handler('main', 'db1', compress=compress)
+            self.assertTrue(handler.run())
+            self.assertTrue(handler.restore())
+            self.assertTrue(self.restored().endswith(" db1\n"))
+            handler.cleanup()
+
+    def test_restore_handler_artifacts(self):
+        first, second = self.handler('a', 'dba'), self.handler('b', 'dbb')
+        first.timestamp = lambda: '2013-01-01_0200'
+        second.timestamp = lambda: '2013-01-02_0200'
+        self.assertTrue(first.run())
+        self.assertTrue(second.run())
+
+        # newer artifacts of other handlers are ignored
+        self.assertTrue(first.restore())
+        self.assertTrue(self.restored().endswith(" dba\n"))
+
+        os.remove(os.path.join(first.env.remote_path(), '.bytehold-index'))
+        self.assertTrue(first.restore())
+        self.assertTrue(self.restored().endswith(" dba\n"))
+        first.cleanup()
+        second.cleanup()
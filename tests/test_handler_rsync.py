@@ -0,0 +1,94 @@
+import os
+import sys
+import shutil
+import filecmp
+import tempfile
+from unittest import TestCase
+from bytehold.env import Environment
+from bytehold.handlers.fs import *
+
+# rsync stand-in: copies source to destination directory, hardlinking
+# files that are equal on --link-dest directory.
+RSYNC_SHIM = r"""
+import os, sys, shutil, filecmp
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith("-") or arg.startswith("--link-dest=")]
+link_dest = None
+if args[0].startswith("--link-dest="):
+    link_dest = args.pop(0).split("=", 1)[1]
+src, dst = args
+if not os.path.exists(src):
+    sys.exit(23)
+
+# with trailing slash, content of source is copied
+base = src if src.endswith("/") else os.path.dirname(src)
+for root, dirs, files in os.walk(src):
+    rel = os.path.relpath(root, base)
+    os.makedirs(os.path.join(dst, rel), exist_ok=True)
+    for fname in files:
+        target = os.path.join(dst, rel, fname)
+        previous = os.path.join(link_dest, rel, fname) if link_dest else None
+        if previous and os.path.isfile(previous) and \
+                filecmp.cmp(previous, os.path.join(root, fname), shallow=False):
+            os.link(previous, target)
+        else:
+            shutil.copy2(os.path.join(root, fname), target)
+"""
+
+
+class FileSystemSnapshotTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmpdir, "remote")
+        self.source = os.path.join(self.tmpdir, "data")
+        os.makedirs(self.source)
+        with open(os.path.join(self.source, "a.txt"), "w") as f:
+            f.write("a")
+
+        shim = os.path.join(self.tmpdir, "rsync.py")
+        with open(shim, "w") as f:
+            f.write(RSYNC_SHIM)
+
+        self.env = Environment.isolated(name='test', destination='local', remote_path=self.remote,
+                                        rsync_command="{0} {1} -avr".format(sys.executable, shim))
+        self.env.__enter__()
+        self.handler = FileSystem(name='home', paths=[self.source], snapshots=2,
+                                  auto_register=False)
+        self.snapshots_path = os.path.join(self.remote, "test", "home")
+        self.stamps = iter(["2013-01-0{0}_0200".format(day) for day in range(1, 10)])
+        self.handler.timestamp = lambda: next(self.stamps)
+
+    def tearDown(self):
+        self.env.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_snapshot(self):
+        self.assertTrue(self.handler.run())
+        self.assertEqual(sorted(os.listdir(self.snapshots_path)), ["2013-01-01_0200", "latest"])
+        self.assertEqual(os.readlink(os.path.join(self.snapshots_path, "latest")), "2013-01-01_0200")
+
+        self.assertTrue(self.handler.run())
+        self.assertTrue(self.handler.run())
+        self.assertEqual(sorted(os.listdir(self.snapshots_path)),
+                         ["2013-01-02_0200", "2013-01-03_0200", "latest"])
+        self.assertEqual(os.readlink(os.path.join(self.snapshots_path, "latest")), "2013-01-03_0200")
+
+        # unchanged files are hardlinked against previous snapshot
+        first = os.stat(os.path.join(self.snapshots_path, "2013-01-02_0200", "data", "a.txt"))
+        last = os.stat(os.path.join(self.snapshots_path, "2013-01-03_0200", "data", "a.txt"))
+        self.assertEqual(first.st_ino, last.st_ino)
+
+    def test_failed_snapshot(self):
+        self.assertTrue(self.handler.run())
+
+        # partial snapshot of a killed execution
+        os.makedirs(os.path.join(self.snapshots_path, ".2012-12-31_0200.partial"))
+        self.handler.config['paths'] = [self.source, os.path.join(self.tmpdir, "not-exists")]
+        self.assertFalse(self.handler.run())
+        self.assertEqual(sorted(os.listdir(self.snapshots_path)), ["2013-01-01_0200", "latest"])
+        self.assertEqual(os.readlink(os.path.join(self.snapshots_path, "latest")), "2013-01-01_0200")
+
+        restore_path = os.path.join(self.tmpdir, "restore")
+        self.assertTrue(self.handler.restore(target=restore_path))
+        self.assertTrue(filecmp.cmp(os.path.join(restore_path, "data", "a.txt"),
+                                    os.path.join(self.source, "a.txt"), shallow=False))
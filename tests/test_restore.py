@@ -0,0 +1,37 @@
+from unittest import TestCase
+from bytehold.restore import *
+
+
+class FakeHandler(object):
+    handler_name = "FakeHandler"
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.restored = []
+
+    def restore(self, stamp=None, target=None):
+        if self.error is not None:
+            raise self.error
+        self.restored.append((stamp, target))
+        return True
+
+
+class RestoreTest(TestCase):
+    def test_run(self):
+        handlers = [FakeHandler("a"), FakeHandler("b")]
+        self.assertTrue(Restore(handlers, stamp="2013-01-01_0200", jobs=2).run())
+        self.assertEqual([h.restored for h in handlers], [[("2013-01-01_0200", None)]] * 2)
+
+    def test_shared_target(self):
+        handlers = [FakeHandler("a"), FakeHandler("b")]
+        self.assertFalse(Restore(handlers, target="/srv/restore").run())
+        self.assertEqual([h.restored for h in handlers], [[], []])
+
+        self.assertTrue(Restore(handlers, names=["b"], target="/srv/restore").run())
+        self.assertEqual([h.restored for h in handlers], [[], [(None, "/srv/restore")]])
+
+    def test_exception(self):
+        handlers = [FakeHandler("a", error=OSError("failed")), FakeHandler("b")]
+        self.assertFalse(Restore(handlers, jobs=2).run())
+        self.assertEqual(handlers[1].restored, [(None, None)])
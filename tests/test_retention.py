@@ -0,0 +1,44 @@
+from unittest import TestCase
+from bytehold.retention import *
+
+
+class RetentionTest(TestCase):
+    def daily(self, days, start=datetime.datetime(2013, 1, 1, 2, 0)):
+        return [(start + datetime.timedelta(days=i)).strftime(stamp_format) for i in range(days)]
+
+    def test_artifact_stamp(self):
+        self.assertEqual(artifact_stamp("test.2013-01-03_0200.postgresql.sql.xz"), "2013-01-03_0200")
+        self.assertEqual(artifact_stamp("test.postgresql-wal.catalog.json"), None)
+
+    def test_no_policy(self):
+        self.assertEqual(select_expired(self.daily(10)), [])
+        self.assertEqual(select_expired([], keep_daily=1), [])
+
+    def test_keep_daily(self):
+        stamps = self.daily(10)
+        self.assertEqual(select_expired(stamps, keep_daily=3), stamps[:7])
+
+    def test_keep_newest_of_day(self):
+        stamps = ["2013-01-01_0200", "2013-01-01_1400", "2013-01-02_0200", "2013-01-02_1400"]
+        self.assertEqual(select_expired(stamps, keep_daily=2), ["2013-01-01_0200", "2013-01-02_0200"])
+
+    def test_gfs(self):
+        stamps = self.daily(100)
+        expired = select_expired(stamps, keep_daily=7, keep_weekly=4, keep_monthly=3)
+        kept = sorted(set(stamps) - set(expired))
+
+        # 2013-04-10 is the newest, periods include it
+        self.assertEqual(kept, [
+            "2013-02-28_0200",  # month
+            "2013-03-24_0200",  # week
+            "2013-03-31_0200",  # week and month
+            "2013-04-04_0200", "2013-04-05_0200", "2013-04-06_0200",
+            "2013-04-07_0200",  # day and week
+            "2013-04-08_0200", "2013-04-09_0200",
+            "2013-04-10_0200",  # day, week and month
+        ])
+
+    def test_always_keep_newest(self):
+        stamps = self.daily(3)
+        self.assertEqual(select_expired(stamps, keep_weekly=0, keep_monthly=0, keep_daily="0"), [])
+        self.assertNotIn(stamps[-1], select_expired(stamps, keep_monthly=1))
@@ -0,0 +1,55 @@
+import time
+from subprocess import Popen
+from unittest import TestCase
+from bytehold.supervisor import *
+
+
+class SupervisorTest(TestCase):
+    def setUp(self):
+        self.poll_interval = Supervisor.poll_interval
+        Supervisor.poll_interval = 0.1
+
+    def tearDown(self):
+        Supervisor.poll_interval = self.poll_interval
+
+    def supervise(self, command, **kwargs):
+        p = Popen(command, start_new_session=True)
+        supervisor = Supervisor([p], **kwargs)
+        supervisor.start()
+        p.wait()
+        return supervisor
+
+    def test_deadline(self):
+        start = time.time()
+        supervisor = self.supervise(["sleep", "30"], deadline=time.time() + 0.3)
+        self.assertFalse(supervisor.finish())
+        self.assertEqual(supervisor.reason, "deadline reached")
+        self.assertTrue(time.time() - start < 10)
+
+    def test_stall(self):
+        supervisor = self.supervise(["sleep", "30"], stall_timeout=0.3)
+        self.assertFalse(supervisor.finish())
+        self.assertTrue(supervisor.reason.startswith("stalled"))
+
+    def test_success(self):
+        supervisor = self.supervise(["true"], deadline=time.time() + 30, stall_timeout=30)
+        self.assertTrue(supervisor.finish())
+
+    def test_regulate(self):
+        p = Popen(["sleep", "30"], start_new_session=True)
+        supervisor = Supervisor([p], pressure=(50, 10))
+
+        supervisor.host_pressure = lambda: 80.0
+        supervisor.regulate()
+        self.assertTrue(supervisor.paused)
+
+        supervisor.host_pressure = lambda: 30.0
+        supervisor.regulate()
+        self.assertTrue(supervisor.paused)
+
+        supervisor.host_pressure = lambda: 5.0
+        supervisor.regulate()
+        self.assertFalse(supervisor.paused)
+
+        p.kill()
+        p.wait()
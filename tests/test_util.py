@@ -2,6 +2,8 @@ from unittest import TestCase
 from bytehold.util import *
 from bytehold.exceptions import FileDoesNotExists
 import os
+import shutil
+import tempfile
 
 
 class UtilTest(TestCase):
@@ -24,3 +26,29 @@ class UtilTest(TestCase):
                 absolute_path("not-existing-file"), 
                 os.path.join(current_dir, "not-existing-file")
         )
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size(100), 100)
+        self.assertEqual(parse_size("100"), 100)
+        self.assertEqual(parse_size("4k"), 4096)
+        self.assertEqual(parse_size("512M"), 512 * 1024 ** 2)
+        self.assertEqual(parse_size("1.5GB"), 3 * 512 * 1024 ** 2)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
+
+    def test_copy_file(self):
+        tmpdir = tempfile.mkdtemp()
+        src, dst = os.path.join(tmpdir, "src"), os.path.join(tmpdir, "dst")
+
+        with open(src, "wb") as f:
+            f.write(b"start")
+            f.seek(8 * 1024 * 1024)
+            f.write(b"middle")
+            f.truncate(16 * 1024 * 1024)
+
+        copy_file(src, dst)
+
+        with open(src, "rb") as fsrc, open(dst, "rb") as fdst:
+            self.assertEqual(fsrc.read(), fdst.read())
+        self.assertTrue(os.stat(dst).st_blocks <= os.stat(src).st_blocks)
+        shutil.rmtree(tmpdir)